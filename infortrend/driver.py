@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import os
+
 from oslo_config import cfg
 from oslo_log import log
 
@@ -50,6 +52,119 @@ infortrend_nas_opts = [
     cfg.IntOpt('infortrend_ssh_timeout',
                default=30,
                help='SSH timeout in seconds.'),
+    cfg.IntOpt('infortrend_ssh_pool_size',
+               default=4,
+               min=1,
+               help='Number of SSH sessions kept open to the Infortrend NAS '
+               'server. Commands check out one idle session each, so '
+               'this bounds how many of them run at the same time.'),
+    cfg.BoolOpt('infortrend_nascli_session',
+                default=False,
+                help='Keep an interactive NASCLI shell open on each pooled '
+                'SSH session and send commands to it, instead of starting '
+                'a new NASCLI process for every command. Only enable this '
+                'if the NAS login shell of infortrend_nas_user is NASCLI.'),
+    cfg.IntOpt('infortrend_stats_concurrency',
+               default=4,
+               min=1,
+               help='Maximum number of pools whose quota usage is queried '
+               'at the same time while updating pool stats.'),
+    cfg.IntOpt('infortrend_stats_pool_timeout',
+               default=20,
+               min=1,
+               help='Seconds to wait for the quota usage of one pool while '
+               'updating pool stats. A pool that times out is reported '
+               'with its last known usage.'),
+    cfg.IntOpt('infortrend_pool_cache_ttl',
+               default=300,
+               min=0,
+               help='Seconds to cache pool data (volume id, directory, '
+               'size, used and free) read by folder status. Set 0 to '
+               'read it from NAS every time.'),
+    cfg.IntOpt('infortrend_channel_cache_ttl',
+               default=60,
+               min=0,
+               help='Seconds to cache channel IPs and status used for '
+               'export locations. Channels are also refreshed in the '
+               'background at this interval, and at once while any '
+               'channel is down. Set 0 to read them from NAS every time.'),
+    cfg.IntOpt('infortrend_user_cache_ttl',
+               default=300,
+               min=0,
+               help='Seconds to cache the NAS user list used to check CIFS '
+               'access rules. A user missing from the cached list reloads '
+               'it once. Set 0 to read it from NAS every time.'),
+    cfg.IntOpt('infortrend_share_cache_ttl',
+               default=600,
+               min=0,
+               help='Seconds to keep the index of folder names in each pool '
+               'used to check whether a share exists. The driver updates '
+               'it on its own create, delete and rename, and a missing '
+               'folder rebuilds it once. Set 0 to read it from NAS '
+               'every time.'),
+    cfg.IntOpt('infortrend_quota_cache_ttl',
+               default=60,
+               min=0,
+               help='Seconds to reuse the folder quota table of each pool '
+               'when reporting share usage sizes. Quota sweeps of pool '
+               'stats, managing and shrinking a share always read it from '
+               'NAS. Set 0 to read it from NAS every time.'),
+    cfg.BoolOpt('infortrend_ensure_shares_check_exist',
+                default=False,
+                help='Check that every share still exists on the Infortrend '
+                'NAS server while ensuring shares at service startup, '
+                'listing the folders of each pool once. Missing shares are '
+                'set to error.'),
+    cfg.IntOpt('infortrend_warm_pool_size',
+               default=0,
+               min=0,
+               help='Number of empty placeholder folders kept in each pool. '
+               'A new share renames one of them instead of creating a '
+               'folder, and they are created again in the background. '
+               'Set 0 to create a folder for every share.'),
+    cfg.BoolOpt('infortrend_async_delete',
+                default=False,
+                help='Delete shares in the background. delete_share only '
+                'disables NFS and CIFS on the share and records its folder '
+                'in a local queue file, and a background worker deletes '
+                'the queued folders and retries failed ones.'),
+    cfg.StrOpt('infortrend_delete_queue_dir',
+               default='$state_path',
+               help='Directory of the delete queue file used when '
+               'infortrend_async_delete is set. The file is named after '
+               'the backend config group.'),
+    cfg.IntOpt('infortrend_delete_concurrency',
+               default=2,
+               min=1,
+               help='Maximum number of queued folders deleted at the same '
+               'time when infortrend_async_delete is set.'),
+    cfg.IntOpt('infortrend_quota_sweep_interval',
+               default=10,
+               min=1,
+               help='Sum the folder quotas of each pool from NAS every this '
+               'many stats updates. In between, pool usage is counted '
+               'from the driver\'s own share size changes, and a pool is '
+               'summed again at once when a change could not be counted. '
+               'Set 1 to sum them on every stats update.'),
+    cfg.BoolOpt('infortrend_thin_provisioning',
+                default=False,
+                help='Report pools as thin provisioned. Free capacity is then '
+                'the real free space of the pool, the sum of folder quotas '
+                'is reported as provisioned capacity, and the scheduler '
+                'limits it by max_over_subscription_ratio.'),
+    cfg.IntOpt('infortrend_stats_refresh_interval',
+               default=0,
+               min=0,
+               help='Seconds between pool stats collected in the background. '
+               'Share stats updates then report the latest collected '
+               'stats at once, tagged with their age. Set 0 to collect '
+               'pool stats during every share stats update.'),
+    cfg.IntOpt('infortrend_stats_max_staleness',
+               default=300,
+               min=1,
+               help='Maximum age in seconds of background pool stats. Older '
+               'stats are collected again during the share stats update. '
+               'Must be greater than infortrend_stats_refresh_interval.'),
 ]
 
 CONF = cfg.CONF
@@ -83,11 +198,61 @@ class InfortrendNASDriver(driver.ShareDriver):
                     'should be set.')
             raise exception.InvalidParameterValue(err=msg)
 
+        stats_refresh_interval = self.configuration.safe_get(
+            'infortrend_stats_refresh_interval')
+        stats_max_staleness = self.configuration.safe_get(
+            'infortrend_stats_max_staleness')
+        if stats_refresh_interval and (
+                stats_refresh_interval >= stats_max_staleness):
+            msg = _('infortrend_stats_refresh_interval should be less than '
+                    'infortrend_stats_max_staleness, or every share stats '
+                    'update would collect pool stats again.')
+            raise exception.InvalidParameterValue(err=msg)
+
         pool_dict = self._init_pool_dict()
         channel_dict = self._init_channel_dict()
-        self.ift_nas = infortrend_nas.InfortrendNAS(nas_ip, username, password,
-                                                    ssh_key, timeout,
-                                                    pool_dict, channel_dict)
+        delete_queue_path = None
+        if self.configuration.safe_get('infortrend_async_delete'):
+            delete_queue_path = os.path.join(
+                self.configuration.safe_get('infortrend_delete_queue_dir'),
+                'infortrend_delete_queue_%s.json' % (
+                    self.configuration.config_group or 'default'))
+        self.ift_nas = infortrend_nas.InfortrendNAS(
+            nas_ip, username, password, ssh_key, timeout,
+            pool_dict, channel_dict,
+            ssh_pool_size=self.configuration.safe_get(
+                'infortrend_ssh_pool_size'),
+            cli_session=self.configuration.safe_get(
+                'infortrend_nascli_session'),
+            stats_concurrency=self.configuration.safe_get(
+                'infortrend_stats_concurrency'),
+            stats_pool_timeout=self.configuration.safe_get(
+                'infortrend_stats_pool_timeout'),
+            pool_cache_ttl=self.configuration.safe_get(
+                'infortrend_pool_cache_ttl'),
+            channel_cache_ttl=self.configuration.safe_get(
+                'infortrend_channel_cache_ttl'),
+            user_cache_ttl=self.configuration.safe_get(
+                'infortrend_user_cache_ttl'),
+            share_cache_ttl=self.configuration.safe_get(
+                'infortrend_share_cache_ttl'),
+            quota_cache_ttl=self.configuration.safe_get(
+                'infortrend_quota_cache_ttl'),
+            ensure_check_exist=self.configuration.safe_get(
+                'infortrend_ensure_shares_check_exist'),
+            warm_pool_size=self.configuration.safe_get(
+                'infortrend_warm_pool_size'),
+            delete_queue_path=delete_queue_path,
+            delete_concurrency=self.configuration.safe_get(
+                'infortrend_delete_concurrency'),
+            quota_sweep_interval=self.configuration.safe_get(
+                'infortrend_quota_sweep_interval'),
+            thin_provisioning=self.configuration.safe_get(
+                'infortrend_thin_provisioning'),
+            max_over_subscription_ratio=self.configuration.safe_get(
+                'max_over_subscription_ratio'),
+            stats_refresh_interval=stats_refresh_interval,
+            stats_max_staleness=stats_max_staleness)
 
     def _init_pool_dict(self):
         pools_names = self.configuration.safe_get('infortrend_share_pools')
@@ -120,11 +285,32 @@ class InfortrendNASDriver(driver.ShareDriver):
             driver_version=self.VERSION,
             storage_protocol=self.PROTOCOL,
             reserved_percentage=self.configuration.reserved_share_percentage,
-            pools=self.ift_nas.update_pools_stats())
+            pools=self.ift_nas.get_pools_stats())
         LOG.debug('Infortrend pools status: %s', data['pools'])
 
         super(InfortrendNASDriver, self)._update_share_stats(data)
 
+    def update_share_usage_size(self, context, shares):
+        """Invoked to get the usage size of given shares.
+
+        The quota table of each pool is read once for all of its shares.
+
+        :param shares: None or a list of all shares for updates.
+        :returns: list of dictionary with ``id``, ``used_size`` in GiB
+                  and ``gathered_at`` of the shares.
+        """
+        return self.ift_nas.update_share_usage_size(shares or [])
+
+    def get_default_filter_function(self, pool=None):
+        """Skip pools whose controller is saturated."""
+        return ('capabilities.infortrend_cpu_rate < 95 and '
+                'capabilities.infortrend_mem_rate < 95')
+
+    def get_default_goodness_function(self):
+        """Prefer pools whose controller is less loaded."""
+        return ('max(0, 100 - max(capabilities.infortrend_cpu_rate, '
+                'capabilities.infortrend_mem_rate))')
+
     def update_access(self, context, share, access_rules, add_rules,
                       delete_rules, share_server=None):
         """Update access rules for given share.
@@ -183,6 +369,29 @@ class InfortrendNASDriver(driver.ShareDriver):
         """
         return self.ift_nas.ensure_share(share, share_server)
 
+    def get_backend_info(self, context):
+        """Get driver and array configuration parameters.
+
+        The share manager ensures shares again only if they change.
+
+        :returns: A dictionary containing driver-specific info.
+        """
+        return self.ift_nas.get_backend_info(self.VERSION)
+
+    def ensure_shares(self, context, shares):
+        """Invoked to ensure that shares are exported.
+
+        Export locations of all shares are built from one read of the
+        channels, instead of one read per share by ensure_share.
+
+        :param shares: A list of all shares for updates.
+        :returns: dictionary of updates keyed by share id, each one with
+                  ``export_locations``, ``status`` and
+                  ``reapply_access_rules``.
+        """
+        LOG.debug('Ensuring %s shares.', len(shares))
+        return self.ift_nas.ensure_shares(shares)
+
     def manage_existing(self, share, driver_options):
         """Brings an existing share under Manila management.
 
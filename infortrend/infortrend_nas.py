@@ -14,11 +14,22 @@
 #    under the License.
 
 import json
+import os
+import random
 import re
+import time
+import weakref
 
+from eventlet import greenpool
+from eventlet import greenthread
+from eventlet import timeout as eventlet_timeout
 from oslo_concurrency import processutils
 from oslo_log import log
+from oslo_service import loopingcall
+from oslo_utils import excutils
+from oslo_utils import timeutils
 from oslo_utils import units
+from oslo_utils import uuidutils
 
 from manila.common import constants
 from manila import exception
@@ -33,40 +44,339 @@ def _bi_to_gi(bi_size):
     return bi_size / units.Gi
 
 
+class NASUnreachableException(exception.InfortrendNASException):
+
+    message = _("Infortrend NAS is unreachable: %(err)s")
+
+
+# Read-through cache of NAS query results, a ttl of 0 turns it off.
+class TTLCache(object):
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.data = {}
+
+    def get(self, key, loader):
+        cached = self.data.get(key)
+        if cached and time.time() - cached[0] < self.ttl:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def lookup(self, key, loader, found):
+        # Reload once if found(value) is False, unless it was just loaded.
+        misses = self.misses
+        value = self.get(key, loader)
+        if not found(value) and self.misses == misses:
+            self.invalidate(key)
+            value = self.get(key, loader)
+        return value
+
+    def peek(self, key):
+        cached = self.data.get(key)
+        return cached[1] if cached else None
+
+    def set(self, key, value):
+        self.data[key] = (time.time(), value)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self.data.clear()
+        else:
+            self.data.pop(key, None)
+
+    def log_stats(self):
+        LOG.debug('Cache [%(name)s] hits: %(hits)s, misses: %(misses)s.', {
+            'name': self.name, 'hits': self.hits, 'misses': self.misses})
+
+
+# Interactive NASCLI shell kept open on one pooled SSH session.
+# Responses are framed by their '(a, b, c, d)' header and one line
+# JSON body, prompts and echoed commands are discarded.
+class NASCLISession(object):
+
+    _RECV_SIZE = 65535
+    _HEADER_PATTERN = re.compile(br'^\(\d+, \d+, \d+, \d+\)\r?$', re.M)
+
+    def __init__(self, ssh, timeout):
+        self.channel = ssh.invoke_shell()
+        self.channel.settimeout(timeout)
+        self.buffer = b''
+
+    def is_active(self):
+        return (not self.channel.closed and
+                self.channel.get_transport().is_active())
+
+    def close(self):
+        self.channel.close()
+
+    def execute(self, commands):
+        # Several command lines are pipelined, one response for each line.
+        self.buffer = b''
+        self.channel.sendall(commands + '\n')
+        return ''.join(
+            self.read_response() for line in commands.splitlines())
+
+    def read_response(self):
+        response = self._pop_response()
+        while response is None:
+            data = self.channel.recv(self._RECV_SIZE)
+            if not data:
+                msg = _('NASCLI session is closed by NAS.')
+                raise NASUnreachableException(err=msg)
+            self.buffer += data
+            response = self._pop_response()
+
+        return response
+
+    def _pop_response(self):
+        header = self._HEADER_PATTERN.search(self.buffer)
+        if not header:
+            return None
+
+        start = header.end()
+        while True:
+            end = self.buffer.find(b'\n', start)
+            if end == -1:
+                return None
+            body = self.buffer[start:end].strip()
+            if body:
+                break
+            start = end + 1
+
+        self.buffer = self.buffer[end + 1:]
+        response = header.group().strip() + b'\n\n' + body + b'\n'
+        return response.decode('utf-8')
+
+
 class InfortrendNAS(object):
 
     _SSH_PORT = 22
+    _CONTROLLER_RETRY_INTERVAL = 60
+    _DELETE_QUEUE_INTERVAL = 30
+    # Fraction of the stats refresh interval added or removed at random.
+    _STATS_REFRESH_JITTER = 0.1
+    _READ_ONLY_COMMANDS = (
+        ('folder', 'status'),
+        ('fquota', 'status'),
+        ('pagelist',),
+        ('share', 'status'),
+        ('ifconfig',),
+        ('service', 'status'),
+        ('acl', 'get'),
+        ('useradmin', 'user', 'list'),
+    )
+    # Maximum number of clients joined into one bulk access command.
+    _BULK_ACCESS_SIZE = 32
+    _CIFS_ACCESS_MAP = {
+        constants.ACCESS_LEVEL_RW: 'f',
+        constants.ACCESS_LEVEL_RO: 'r',
+    }
+    # Name prefix of the placeholder folders kept in the warm pool.
+    _WARM_FOLDER_PREFIX = 'manilawarm'
+    _CLI_HEADER_PATTERN = re.compile(r'^\(\d+, \d+, \d+, \d+\)$', re.M)
 
     def __init__(self, nas_ip, username, password, ssh_key,
-                 timeout, pool_dict, channel_dict):
+                 timeout, pool_dict, channel_dict, ssh_pool_size=1,
+                 cli_session=False, stats_concurrency=1,
+                 stats_pool_timeout=None, pool_cache_ttl=0,
+                 channel_cache_ttl=0, user_cache_ttl=0,
+                 share_cache_ttl=0, quota_cache_ttl=0,
+                 ensure_check_exist=False,
+                 warm_pool_size=0, delete_queue_path=None,
+                 delete_concurrency=1, quota_sweep_interval=1,
+                 thin_provisioning=False, max_over_subscription_ratio=None,
+                 stats_refresh_interval=0, stats_max_staleness=None):
         self.nas_ip = nas_ip
         self.port = self._SSH_PORT
         self.username = username
         self.password = password
         self.ssh_key = ssh_key
         self.ssh_timeout = timeout
+        self.ssh_pool_size = ssh_pool_size
+        self.cli_session = cli_session
+        self.cli_sessions = weakref.WeakKeyDictionary()
+        self.stats_concurrency = stats_concurrency
+        self.stats_pool_timeout = stats_pool_timeout
+        self.pool_quota_used = {}
+        self.quota_sweep_interval = quota_sweep_interval
+        self.quota_drift = set()
+        self.stats_cycles = 0
+        self.thin_provisioning = thin_provisioning
+        self.max_over_subscription_ratio = max_over_subscription_ratio
+        self.stats_refresh_interval = stats_refresh_interval
+        self.stats_max_staleness = stats_max_staleness
+        self.stats_refresher = None
+        self.pools_stats = None
+        self.pools_stats_time = None
+        self.controller_load = {}
+        self.pool_cache = TTLCache('folder status', pool_cache_ttl)
+        self.channel_cache = TTLCache('ifconfig', channel_cache_ttl)
+        self.channels_down = set()
+        self.channel_refresher = None
+        self.user_cache = TTLCache('useradmin user list', user_cache_ttl)
+        self.share_cache = TTLCache('pagelist folder', share_cache_ttl)
+        self.quota_cache = TTLCache('fquota status', quota_cache_ttl)
+        self.ensure_check_exist = ensure_check_exist
+        self.warm_pool_size = warm_pool_size
+        self.warm_folders = {}
+        self.warm_refilling = False
+        self.delete_queue_path = delete_queue_path
+        self.delete_concurrency = delete_concurrency
+        self.delete_queue = []
+        self.delete_worker = None
         self.pool_dict = pool_dict
         self.channel_dict = channel_dict
         self.command = ""
-        self.ssh = None
         self.sshpool = None
         self.location = 'a@0'
+        self.locations = [self.location]
+        self.controller_down_until = {}
+        self.read_index = 0
 
     def _execute(self, command_line):
-        command_line.extend(['-z', self.location])
-        commands = ' '.join(command_line)
-        manila_utils.check_ssh_injection(commands)
-        LOG.debug('Executing: %(command)s', {'command': commands})
+        read_only = self._is_read_only(command_line)
+        if read_only:
+            locations = self._get_read_locations()
+        else:
+            # Mutating commands are never retried on the other controller,
+            # since NAS may have applied it before it stopped answering.
+            locations = [self.location]
 
-        cli_out = self._ssh_execute(commands)
+        for location in locations:
+            commands = ' '.join(command_line + ['-z', location])
+            manila_utils.check_ssh_injection(commands)
+            LOG.debug('Executing: %(command)s', {'command': commands})
 
-        return self._parser(cli_out)
+            try:
+                cli_out = self._ssh_execute(commands)
+            except NASUnreachableException as e:
+                if read_only:
+                    self._set_controller_down(location, e)
+                if location == locations[-1]:
+                    raise
+            else:
+                # A failed command is not retried on the other controller.
+                return self._parser(cli_out)
+
+    def _is_read_only(self, command_line):
+        return any(tuple(command_line[:len(command)]) == command
+                   for command in self._READ_ONLY_COMMANDS)
+
+    def _get_alive_locations(self):
+        now = time.time()
+        alive_locations = [
+            location for location in self.locations
+            if self.controller_down_until.get(location, 0) <= now]
+        return alive_locations or list(self.locations)
+
+    def _get_read_locations(self):
+        # Spread read-only commands over controllers in turn, and keep the
+        # others as fallbacks.
+        locations = self._get_alive_locations()
+        self.read_index = (self.read_index + 1) % len(locations)
+        return locations[self.read_index:] + locations[:self.read_index]
+
+    def _set_controller_down(self, location, reason):
+        # Both controllers answer on nas_ip, so an unreachable NAS does not
+        # tell which one stopped answering. Only reads are moved away, and
+        # mutating commands always stay on the owner controller.
+        if len(self.locations) > 1:
+            LOG.warning('Controller [%(location)s] is not answering, '
+                        'read from other controller for %(interval)s seconds, '
+                        'reason: %(reason)s.', {
+                            'location': location,
+                            'interval': self._CONTROLLER_RETRY_INTERVAL,
+                            'reason': reason})
+            self.controller_down_until[location] = (
+                time.time() + self._CONTROLLER_RETRY_INTERVAL)
+
+    def _execute_batch(self, command_lines, raise_error=True):
+        # Run command_lines in one SSH round trip, return [(rc, result)].
+        read_only = all(self._is_read_only(command_line)
+                        for command_line in command_lines)
+        if read_only:
+            location = self._get_read_locations()[0]
+        else:
+            location = self.location
+
+        commands_list = []
+        for command_line in command_lines:
+            commands = ' '.join(command_line + ['-z', location])
+            manila_utils.check_ssh_injection(commands)
+            commands_list.append(commands)
+        LOG.debug('Executing batch: %(commands)s', {
+            'commands': commands_list})
+
+        # Exit code only reflects the last command, errors are taken
+        # from cliCode of every response instead.
+        try:
+            cli_out = self._ssh_execute(
+                '\n'.join(commands_list), check_exit_code=False)
+        except NASUnreachableException as e:
+            if read_only:
+                self._set_controller_down(location, e)
+            raise
+        responses = self._split_responses(cli_out)
+
+        results = []
+        for index, commands in enumerate(commands_list):
+            if index < len(responses):
+                try:
+                    results.append(self._parser(responses[index]))
+                    continue
+                except exception.InfortrendCLIException as e:
+                    rc, out = e.kwargs['rc'], e.kwargs['out']
+                except exception.InfortrendNASException as e:
+                    rc, out = None, e.msg
+                except (IndexError, KeyError, ValueError) as e:
+                    # Output cut off after the header, or malformed body.
+                    rc, out = None, _('Failed to parse data: %(data)s, '
+                                      'reason: %(e)s.') % {
+                                          'data': responses[index], 'e': e}
+            else:
+                rc, out = None, _('No data is returned from NAS.')
+
+            if raise_error:
+                msg = _('Batch command [%(commands)s] (%(index)s of '
+                        '%(total)s) failed, returned: %(out)s.') % {
+                            'commands': commands,
+                            'index': index + 1,
+                            'total': len(commands_list),
+                            'out': out}
+                LOG.error(msg)
+                raise exception.InfortrendNASException(err=msg)
+            results.append((rc, out))
+
+        return results
 
-    def _ssh_execute(self, commands):
+    def _split_responses(self, cli_out):
+        cli_out = cli_out.replace('\r', '')
+        starts = [header.start() for header in
+                  self._CLI_HEADER_PATTERN.finditer(cli_out)]
+        return [cli_out[start:end] for start, end in
+                zip(starts, starts[1:] + [len(cli_out)])]
+
+    def _ssh_execute(self, commands, check_exit_code=True):
+        if not self.sshpool:
+            self._init_connect()
+
+        # SSHPool.get() hands out an idle session after checking its
+        # transport is still active, and replaces only that session if not.
         try:
-            out, err = processutils.ssh_execute(
-                self.ssh, commands,
-                timeout=self.ssh_timeout, check_exit_code=True)
+            with self.sshpool.item() as ssh:
+                if self.cli_session:
+                    return self._cli_session_execute(ssh, commands)
+                out, err = processutils.ssh_execute(
+                    ssh, commands, timeout=self.ssh_timeout,
+                    check_exit_code=check_exit_code)
         except processutils.ProcessExecutionError as pe:
             rc = pe.exit_code
             out = pe.stdout
@@ -75,9 +385,45 @@ class InfortrendNAS(object):
                     'Exit code: %(rc)d, msg: %(out)s') % {
                         'rc': rc, 'out': out}
             raise exception.InfortrendNASException(err=msg)
+        except NASUnreachableException:
+            raise
+        except Exception as e:
+            # Anything else comes from the SSH connection, not NASCLI.
+            msg = _('Error on ssh connection to execute command: '
+                    '%(commands)s, reason: %(e)s') % {
+                        'commands': commands, 'e': e}
+            raise NASUnreachableException(err=msg)
 
         return out
 
+    def _cli_session_execute(self, ssh, commands):
+        session = self.cli_sessions.get(ssh)
+        if not (session and session.is_active()):
+            session = NASCLISession(ssh, self.ssh_timeout)
+            self.cli_sessions[ssh] = session
+
+        try:
+            return session.execute(commands)
+        except NASUnreachableException:
+            self._close_cli_session(ssh)
+            raise
+        except Exception as e:
+            self._close_cli_session(ssh)
+            msg = _('Error on execute NASCLI session command: '
+                    '%(commands)s, reason: %(e)s') % {
+                        'commands': commands, 'e': e}
+            raise NASUnreachableException(err=msg)
+        except BaseException:
+            # An interrupted read leaves part of the response unread,
+            # so the session can not be used for next command.
+            self._close_cli_session(ssh)
+            raise
+
+    def _close_cli_session(self, ssh):
+        session = self.cli_sessions.pop(ssh, None)
+        if session:
+            session.close()
+
     def _parser(self, content=None):
         LOG.debug('parsing data:\n%s', content)
         content = content.replace("\r", "")
@@ -115,33 +461,52 @@ class InfortrendNAS(object):
 
     def do_setup(self):
         self._init_connect()
+        self._init_controllers()
         self._ensure_service_on('nfs')
         self._ensure_service_on('cifs')
 
     def _init_connect(self):
-        if not (self.sshpool and self.ssh):
+        if not self.sshpool:
+            # conn_timeout also sets the transport keepalive interval, so
+            # idle pooled sessions are kept alive between commands.
             self.sshpool = manila_utils.SSHPool(ip=self.nas_ip,
                                                 port=self.port,
-                                                conn_timeout=None,
+                                                conn_timeout=self.ssh_timeout,
                                                 login=self.username,
                                                 password=self.password,
-                                                privatekey=self.ssh_key)
-            self.ssh = self.sshpool.create()
-
-        if not self.ssh.get_transport().is_active():
-            self.sshpool = manila_utils.SSHPool(ip=self.nas_ip,
-                                                port=self.port,
-                                                conn_timeout=None,
-                                                login=self.username,
-                                                password=self.password,
-                                                privatekey=self.ssh_key)
-            self.ssh = self.sshpool.create()
+                                                privatekey=self.ssh_key,
+                                                min_size=self.ssh_pool_size,
+                                                max_size=self.ssh_pool_size)
+
+        LOG.debug('NAScmd [%(user)s@%(ip)s] start with %(size)s '
+                  'ssh session/s!', {
+                      'user': self.username,
+                      'ip': self.nas_ip,
+                      'size': self.ssh_pool_size})
+
+    def _init_controllers(self):
+        command_line = ['service', 'status', 'nfs']
+        rc, service_status = self._execute(command_line)
+        owner_slot, index = self.location.split('@')
+        self.locations = [self.location]
+        for slot in sorted(service_status[0].keys()):
+            if slot.lower() != owner_slot:
+                self.locations.append(slot.lower() + '@' + index)
 
-        LOG.debug('NAScmd [%s@%s] start!', self.username, self.nas_ip)
+        LOG.debug('NAS controllers: %(locations)s, owner: %(owner)s.', {
+            'locations': self.locations, 'owner': self.location})
 
     def check_for_setup_error(self):
         self._check_pools_setup()
-        self._check_channels_status()
+        self._refresh_channels_status(force=True)
+        self._start_channel_refresher()
+        if self.warm_pool_size:
+            self._load_warm_folders()
+            self._schedule_warm_refill()
+        if self.delete_queue_path:
+            self._start_delete_worker()
+        if self.stats_refresh_interval:
+            self._start_stats_refresher()
 
     def _ensure_service_on(self, proto, slot='A'):
         command_line = ['service', 'status', proto]
@@ -152,6 +517,7 @@ class InfortrendNAS(object):
 
     def _check_channels_status(self):
         channel_list = list(self.channel_dict.keys())
+        channels_down = set()
         command_line = ['ifconfig', 'inet', 'show']
         rc, channels_status = self._execute(command_line)
         for channel in channels_status:
@@ -161,19 +527,56 @@ class InfortrendNAS(object):
                     self.channel_dict[ch] = channel['IP']
                     channel_list.remove(ch)
                     if channel['status'] == 'DOWN':
+                        channels_down.add(ch)
                         LOG.warning('Channel [%(ch)s] status '
                                     'is down, please check.', {
                                         'ch': ch})
+        self.channels_down = channels_down
         if len(channel_list) != 0:
             msg = _('Channel setting %(channel_list)s is invalid!') % {
                 'channel_list': channel_list}
             LOG.error(msg)
             raise exception.InfortrendNASException(message=msg)
 
+    def _refresh_channels_status(self, force=False):
+        # Channel IPs are only trusted from cache while all channels are up
+        # and have an IP, otherwise re-read them until they recover.
+        if (force or self.channels_down or
+                not all(self.channel_dict.values())):
+            self.channel_cache.invalidate()
+        self.channel_cache.get('channels', self._check_channels_status)
+
+    def _start_channel_refresher(self):
+        if self.channel_cache.ttl and not self.channel_refresher:
+            self.channel_refresher = loopingcall.FixedIntervalLoopingCall(
+                self._refresh_channels_in_background)
+            self.channel_refresher.start(
+                interval=self.channel_cache.ttl,
+                initial_delay=self.channel_cache.ttl)
+
+    def _refresh_channels_in_background(self):
+        try:
+            self._refresh_channels_status(force=True)
+        except Exception as e:
+            LOG.warning('Failed to refresh channels status in background, '
+                        'reason: %(e)s.', {'e': e})
+
+    def _get_pools_data(self, refresh=False):
+        def _get_folder_status():
+            command_line = ['folder', 'status']
+            rc, pools_data = self._execute(command_line)
+            return pools_data
+
+        if refresh:
+            self.pool_cache.invalidate('folder status')
+        return self.pool_cache.get('folder status', _get_folder_status)
+
+    def invalidate_pool_cache(self):
+        self.pool_cache.invalidate()
+
     def _check_pools_setup(self):
         pool_list = list(self.pool_dict.keys())
-        command_line = ['folder', 'status']
-        rc, pool_data = self._execute(command_line)
+        pool_data = self._get_pools_data()
         for pool in pool_data:
             pool_name = self._extract_pool_name(pool)
             if pool_name in self.pool_dict.keys():
@@ -184,6 +587,7 @@ class InfortrendNAS(object):
                 break
 
         if len(pool_list) != 0:
+            self.invalidate_pool_cache()
             msg = _('Please create %(pool_list)s pool/s in advance!') % {
                 'pool_list': pool_list}
             LOG.error(msg)
@@ -195,53 +599,254 @@ class InfortrendNAS(object):
     def _extract_lv_name(self, pool_info):
         return pool_info['path'].split('/')[2]
 
+    def get_pools_stats(self):
+        # Serve the background snapshot, tagged with its age, and refresh
+        # it first if it is older than stats_max_staleness.
+        if not self.stats_refresh_interval:
+            return self.update_pools_stats()
+
+        if (self.pools_stats is None or
+                time.time() - self.pools_stats_time >
+                self.stats_max_staleness):
+            LOG.debug('Pool stats snapshot is too old, refresh it now.')
+            self._refresh_pools_stats()
+
+        stats_age = int(time.time() - self.pools_stats_time)
+        return [dict(pool, infortrend_stats_age=stats_age)
+                for pool in self.pools_stats]
+
+    def _refresh_pools_stats(self):
+        self.pools_stats = self.update_pools_stats()
+        self.pools_stats_time = time.time()
+
+    def _start_stats_refresher(self):
+        if not self.stats_refresher:
+            self.stats_refresher = loopingcall.DynamicLoopingCall(
+                self._refresh_pools_stats_in_background)
+            self.stats_refresher.start()
+
+    def _refresh_pools_stats_in_background(self):
+        try:
+            self._refresh_pools_stats()
+        except Exception as e:
+            LOG.warning('Failed to refresh pool stats in background, '
+                        'reason: %(e)s.', {'e': e})
+
+        # Spread the refresh of backends started at the same time.
+        jitter = self._STATS_REFRESH_JITTER
+        return self.stats_refresh_interval * random.uniform(
+            1 - jitter, 1 + jitter)
+
     def update_pools_stats(self):
         pools = []
-        command_line = ['folder', 'status']
-        rc, pools_data = self._execute(command_line)
-
-        for pool_info in pools_data:
+        # Thin provisioning reports the real free and used space of the
+        # pools, which changes with every write, so it is read each cycle.
+        pools_data = self._get_pools_data(refresh=self.thin_provisioning)
+        pools_data = [pool_info for pool_info in pools_data
+                      if self._extract_pool_name(pool_info) in self.pool_dict]
+        sweep = self.stats_cycles % self.quota_sweep_interval == 0
+        self.stats_cycles += 1
+        pools_quota_used = self._run_concurrently(
+            lambda pool_info: self._get_pool_quota_used(
+                self._extract_pool_name(pool_info), sweep),
+            pools_data, self.stats_concurrency, self.stats_pool_timeout)
+
+        controller_load = self._get_controller_load() if pools_data else {}
+
+        for pool_info, pool_quota_used in zip(pools_data, pools_quota_used):
             pool_name = self._extract_pool_name(pool_info)
+            if isinstance(pool_quota_used, BaseException):
+                pool_quota_used = self._get_stale_pool_quota_used(
+                    pool_name, pool_quota_used)
+                if pool_quota_used is None:
+                    continue
+            else:
+                self.pool_quota_used[pool_name] = pool_quota_used
 
-            if pool_name in self.pool_dict.keys():
-                total_space = float(pool_info['size'])
-                pool_quota_used = self._get_pool_quota_used(pool_name)
+            total_space = float(pool_info['size'])
+            if self.thin_provisioning:
+                # Quotas may exceed the pool, report the real free space.
+                available_space = float(pool_info['free'])
+            else:
                 available_space = total_space - pool_quota_used
 
-                total_capacity_gb = round(_bi_to_gi(total_space), 2)
-                free_capacity_gb = round(_bi_to_gi(available_space), 2)
-
-                pool = {
-                    'pool_name': pool_name,
-                    'total_capacity_gb': total_capacity_gb,
-                    'free_capacity_gb': free_capacity_gb,
-                    'reserved_percentage': 0,
-                    'qos': False,
-                    'dedupe': False,
-                    'compression': False,
-                    'snapshot_support': False,
-                    'thin_provisioning': False,
-                    'thick_provisioning': True,
-                    'replication_type': None,
-                }
-                pools.append(pool)
-
+            total_capacity_gb = round(_bi_to_gi(total_space), 2)
+            free_capacity_gb = round(_bi_to_gi(available_space), 2)
+
+            pool = {
+                'pool_name': pool_name,
+                'total_capacity_gb': total_capacity_gb,
+                'free_capacity_gb': free_capacity_gb,
+                'reserved_percentage': 0,
+                'qos': False,
+                'dedupe': False,
+                'compression': False,
+                'snapshot_support': False,
+                'thin_provisioning': False,
+                'thick_provisioning': True,
+                'replication_type': None,
+            }
+            # Load of the controller owning the pool, for the default
+            # goodness_function and filter_function of the driver.
+            load = controller_load.get(pool_info['owner'], {})
+            pool['infortrend_cpu_rate'] = load.get('cpu_rate', 0.0)
+            pool['infortrend_mem_rate'] = load.get('mem_rate', 0.0)
+            if self.thin_provisioning:
+                pool.update({
+                    'thin_provisioning': True,
+                    'thick_provisioning': False,
+                    'provisioned_capacity_gb': round(
+                        _bi_to_gi(pool_quota_used), 2),
+                    'allocated_capacity_gb': round(
+                        _bi_to_gi(float(pool_info['used'])), 2),
+                    'max_over_subscription_ratio': (
+                        self.max_over_subscription_ratio),
+                })
+            if self.delete_queue_path:
+                # Queued folders keep their quota until they are deleted,
+                # so their capacity is still used in free_capacity_gb.
+                pool['infortrend_delete_queue_depth'] = len(
+                    [entry for entry in self.delete_queue
+                     if entry['pool'] == pool_name])
+            pools.append(pool)
+
+        self.pool_cache.log_stats()
         return pools
 
-    def _get_pool_quota_used(self, pool_name):
-        pool_quota_used = 0.0
-        pool_data = self._get_share_pool_data(pool_name)
-        folder_name = self._extract_lv_name(pool_data)
-
-        command_line = ['fquota', 'status', pool_data['id'],
-                        folder_name, '-t', 'folder']
-        rc, quota_status = self._execute(command_line)
-
-        for share_quota in quota_status:
-            pool_quota_used += int(share_quota['quota'])
-
+    def update_share_usage_size(self, shares):
+        pool_shares = {}
+        for share in shares:
+            pool_name = share_utils.extract_host(share['host'], level='pool')
+            pool_shares.setdefault(pool_name, []).append(share)
+
+        pool_names = list(pool_shares)
+        # Used sizes are only reported, so a recent quota table will do.
+        pools_quota = self._run_concurrently(
+            self._get_pool_quota, pool_names,
+            self.stats_concurrency, self.stats_pool_timeout)
+        gathered_at = timeutils.utcnow()
+
+        share_usages = []
+        for pool_name, pool_quota in zip(pool_names, pools_quota):
+            if isinstance(pool_quota, BaseException):
+                LOG.warning('Failed to get quota usage of pool [%(pool)s], '
+                            'skip its shares, reason: %(e)s.', {
+                                'pool': pool_name, 'e': pool_quota})
+                continue
+
+            for share in pool_shares[pool_name]:
+                share_quota = pool_quota.get(share['id'].replace('-', ''))
+                if share_quota is None:
+                    LOG.warning('Quota of share [%s] not found.', share['id'])
+                    continue
+                share_usages.append({
+                    'id': share['id'],
+                    'used_size': round(_bi_to_gi(share_quota['used']), 2),
+                    'gathered_at': gathered_at,
+                })
+
+        return share_usages
+
+    def _get_controller_load(self):
+        # Return {slot: {'cpu_rate', 'mem_rate'}} summed over NFS and CIFS,
+        # or the last known load if they can't be read.
+        command_lines = [['service', 'status', 'nfs'],
+                         ['service', 'status', 'cifs']]
+        results = self._run_concurrently(self._execute, command_lines)
+
+        controller_load = {}
+        try:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+                rc, service_status = result
+                for slot, services in service_status[0].items():
+                    load = controller_load.setdefault(
+                        slot, {'cpu_rate': 0.0, 'mem_rate': 0.0})
+                    for service in services.values():
+                        load['cpu_rate'] += float(service['cpu_rate'])
+                        load['mem_rate'] += float(service['mem_rate'])
+        except Exception as e:
+            LOG.warning('Failed to get controller load, report the last '
+                        'known load, reason: %(e)s.', {'e': e})
+            return self.controller_load
+
+        self.controller_load = controller_load
+        return controller_load
+
+    def _get_stale_pool_quota_used(self, pool_name, error):
+        pool_quota_used = self.pool_quota_used.get(pool_name)
+        if pool_quota_used is None:
+            LOG.warning('Failed to get quota usage of pool [%(pool)s], '
+                        'skip it in stats report, reason: %(e)s.', {
+                            'pool': pool_name, 'e': error})
+        else:
+            LOG.warning('Failed to get quota usage of pool [%(pool)s], '
+                        'report its last known usage, reason: %(e)s.', {
+                            'pool': pool_name, 'e': error})
         return pool_quota_used
 
+    def _get_pool_quota_used(self, pool_name, sweep=True):
+        # The counter follows the driver's own quota changes, so quotas are
+        # only summed again on a sweep or after a change was not counted.
+        quota_used = self.pool_quota_used.get(pool_name)
+        if (not sweep and quota_used is not None and
+                pool_name not in self.quota_drift):
+            return quota_used
+
+        # Sum the quotas on NAS, not the quota index being checked.
+        pool_quota = self._get_pool_quota(pool_name, refresh=True)
+        self.quota_drift.discard(pool_name)
+        swept_quota_used = sum(
+            quota['quota'] for quota in pool_quota.values())
+        if quota_used is not None and quota_used != swept_quota_used:
+            LOG.info('Quota usage of pool [%(pool)s] drifted from '
+                     '%(counted)s to %(swept)s bytes.', {
+                         'pool': pool_name, 'counted': quota_used,
+                         'swept': swept_quota_used})
+        return swept_quota_used
+
+    def _get_pool_quota(self, pool_name, refresh=False):
+        def _get_fquota_status():
+            pool_data = self._get_share_pool_data(pool_name)
+            folder_name = self._extract_lv_name(pool_data)
+            command_line = ['fquota', 'status', pool_data['id'],
+                            folder_name, '-t', 'folder']
+            rc, quota_status = self._execute(command_line)
+            return {
+                share_quota['name']: {
+                    'quota': float(share_quota['quota']),
+                    'used': float(share_quota['used']),
+                } for share_quota in quota_status
+            }
+
+        if refresh:
+            self.quota_cache.invalidate(pool_name)
+        return self.quota_cache.get(pool_name, _get_fquota_status)
+
+    def _update_quota_index(self, pool_name, share_name, quota=None,
+                            rename=None, remove=False):
+        pool_quota = self.quota_cache.peek(pool_name)
+        if pool_quota is None:
+            # The old quota is unknown, count the pool again on next stats.
+            self.quota_drift.add(pool_name)
+            return
+        old_quota = pool_quota.get(share_name, {}).get('quota', 0.0)
+        if remove:
+            pool_quota.pop(share_name, None)
+            self._count_quota_used(pool_name, -old_quota)
+        elif rename:
+            if share_name in pool_quota:
+                pool_quota[rename] = pool_quota.pop(share_name)
+        elif quota is not None:
+            pool_quota.setdefault(share_name, {'used': 0.0})
+            pool_quota[share_name]['quota'] = quota
+            self._count_quota_used(pool_name, quota - old_quota)
+
+    def _count_quota_used(self, pool_name, delta):
+        if pool_name in self.pool_quota_used:
+            self.pool_quota_used[pool_name] += delta
+
     def _get_share_pool_data(self, pool_name):
         if not pool_name:
             msg = _("Pool is not available in the share host.")
@@ -263,13 +868,60 @@ class InfortrendNAS(object):
         share_name = share['id'].replace('-', '')
         share_path = pool_data['path'] + share_name
 
-        command_line = ['folder', 'options', pool_data['id'],
-                        folder_name, '-c', share_name]
-        self._execute(command_line)
-
-        self._set_share_size(
-            pool_data['id'], pool_name, share_name, share['size'])
-        self._ensure_protocol_on(share_path, share_proto, share_name)
+        if share_proto not in ('nfs', 'cifs'):
+            msg = _('Unsupported protocol: [%s].') % share_proto
+            raise exception.InvalidInput(msg)
+
+        # A new folder has no protocol enabled yet, so all writes are sent
+        # in one batch without reading the share status first.
+        create_command = ['folder', 'options', pool_data['id'],
+                          folder_name, '-c', share_name]
+        warm_folder = self._claim_warm_folder(pool_name)
+        if warm_folder:
+            folder_command = ['folder', 'options', pool_data['id'],
+                              folder_name, '-k', warm_folder, share_name]
+        else:
+            folder_command = create_command
+        command_lines = [
+            folder_command,
+            self._get_share_size_command(
+                pool_data['id'], folder_name, share_name, share['size']),
+            self._get_protocol_on_command(
+                share_path, share_proto, share_name),
+        ]
+        try:
+            results = self._execute_batch(command_lines, raise_error=False)
+            if warm_folder and results[0][0] != 0:
+                LOG.warning('Failed to claim warm folder [%(folder)s], '
+                            'create share [%(share)s] instead, reason: '
+                            '%(out)s.', {'folder': warm_folder,
+                                         'share': share['id'],
+                                         'out': results[0][1]})
+                self._release_warm_folder(pool_name, warm_folder)
+                warm_folder = None
+                command_lines[0] = create_command
+                results = self._execute_batch(
+                    command_lines, raise_error=False)
+
+            for command_line, (rc, out) in zip(command_lines, results):
+                if rc != 0:
+                    msg = _('Failed to create share [%(share)s], command '
+                            '[%(command)s] returned: %(out)s.') % {
+                                'share': share['id'],
+                                'command': ' '.join(command_line),
+                                'out': out}
+                    LOG.error(msg)
+                    raise exception.InfortrendNASException(err=msg)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.quota_drift.add(pool_name)
+        finally:
+            if warm_folder:
+                self._schedule_warm_refill()
+        self._update_share_index(
+            pool_name, add=share_name, remove=warm_folder)
+        self._update_quota_index(
+            pool_name, share_name, quota=float(share['size'] * units.Gi))
 
         LOG.info('Create Share [%(share)s] completed.', {
             'share': share['id']})
@@ -277,13 +929,87 @@ class InfortrendNAS(object):
         return self._export_location(
             share_name, share_proto, pool_data['path'])
 
-    def _export_location(self, share_name, share_proto, pool_path=None):
+    def _load_warm_folders(self):
+        # Placeholders left by the last run are claimed before new ones.
+        for pool_name in self.pool_dict:
+            try:
+                share_names = self._get_share_names(pool_name)
+            except (exception.InfortrendNASException,
+                    exception.InfortrendCLIException) as e:
+                LOG.warning('Failed to load warm folders of pool [%(pool)s], '
+                            'reason %(e)s.', {'pool': pool_name, 'e': e})
+                continue
+            self.share_cache.set(pool_name, share_names)
+            self.warm_folders[pool_name] = sorted(
+                name for name in share_names
+                if name.startswith(self._WARM_FOLDER_PREFIX))
+
+    def _claim_warm_folder(self, pool_name):
+        warm_folders = self.warm_folders.get(pool_name)
+        if warm_folders:
+            return warm_folders.pop(0)
+        return None
+
+    def _release_warm_folder(self, pool_name, warm_folder):
+        # Put the placeholder back if it is still on NAS.
+        try:
+            share_names = self._get_share_names(pool_name)
+        except (exception.InfortrendNASException,
+                exception.InfortrendCLIException) as e:
+            LOG.warning('Failed to check warm folder [%(folder)s], '
+                        'reason: %(e)s.', {'folder': warm_folder, 'e': e})
+            return
+        self.share_cache.set(pool_name, share_names)
+        if warm_folder in share_names:
+            self.warm_folders.setdefault(pool_name, []).append(warm_folder)
+
+    def _schedule_warm_refill(self):
+        if not self.warm_refilling:
+            self.warm_refilling = True
+            greenthread.spawn_n(self._refill_warm_pools)
+
+    def _refill_warm_pools(self):
+        # Create the missing placeholders of each pool in one batch.
+        try:
+            for pool_name, pool_data in self.pool_dict.items():
+                warm_folders = self.warm_folders.setdefault(pool_name, [])
+                missing = self.warm_pool_size - len(warm_folders)
+                if missing <= 0:
+                    continue
+
+                folder_name = self._extract_lv_name(pool_data)
+                names = [self._WARM_FOLDER_PREFIX +
+                         uuidutils.generate_uuid(dashed=False)
+                         for i in range(missing)]
+                results = self._execute_batch(
+                    [['folder', 'options', pool_data['id'],
+                      folder_name, '-c', name] for name in names],
+                    raise_error=False)
+                for name, (rc, out) in zip(names, results):
+                    if rc == 0:
+                        warm_folders.append(name)
+                        self._update_share_index(pool_name, add=name)
+                    else:
+                        LOG.warning('Failed to create warm folder '
+                                    '[%(name)s] in pool [%(pool)s], '
+                                    'reason %(out)s.', {
+                                        'name': name, 'pool': pool_name,
+                                        'out': out})
+        except Exception as e:
+            LOG.warning('Failed to refill warm pools, reason: %(e)s.',
+                        {'e': e})
+        finally:
+            self.warm_refilling = False
+
+    def _export_location(self, share_name, share_proto, pool_path=None,
+                         refresh=True):
         location = []
         location_data = {
             'pool_path': pool_path,
             'share_name': share_name,
         }
-        self._check_channels_status()
+        if refresh:
+            self._refresh_channels_status()
         for ch in sorted(self.channel_dict.keys()):
             ip = self.channel_dict[ch]
             if share_proto == 'nfs':
@@ -301,9 +1027,15 @@ class InfortrendNAS(object):
     def _set_share_size(self, pool_id, pool_name, share_name, share_size):
         pool_data = self._get_share_pool_data(pool_name)
         folder_name = self._extract_lv_name(pool_data)
-        command_line = ['fquota', 'create', pool_id, folder_name,
-                        share_name, str(share_size) + 'G', '-t', 'folder']
-        self._execute(command_line)
+        command_line = self._get_share_size_command(
+            pool_id, folder_name, share_name, share_size)
+        try:
+            self._execute(command_line)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.quota_drift.add(pool_name)
+        self._update_quota_index(
+            pool_name, share_name, quota=float(share_size * units.Gi))
 
         LOG.debug('Set Share [%(share_name)s] '
                   'Size [%(share_size)s G] completed.', {
@@ -311,16 +1043,19 @@ class InfortrendNAS(object):
                       'share_size': share_size})
         return
 
+    def _get_share_size_command(self, pool_id, folder_name, share_name,
+                                share_size):
+        return ['fquota', 'create', pool_id, folder_name,
+                share_name, str(share_size) + 'G', '-t', 'folder']
+
     def _get_share_size(self, pool_id, pool_name, share_name):
         share_size = None
-        command_line = ['fquota', 'status', pool_id,
-                        share_name, '-t', 'folder']
-        rc, quota_status = self._execute(command_line)
-
-        for share_quota in quota_status:
-            if share_quota['name'] == share_name:
-                share_size = round(_bi_to_gi(float(share_quota['quota'])), 2)
-                break
+        # Quota of a folder to be managed may be set by admin at any time,
+        # so read it from NAS instead of the index.
+        share_quota = self._get_pool_quota(
+            pool_name, refresh=True).get(share_name)
+        if share_quota:
+            share_size = round(_bi_to_gi(share_quota['quota']), 2)
 
         return share_size
 
@@ -330,142 +1065,373 @@ class InfortrendNAS(object):
         folder_name = self._extract_lv_name(pool_data)
         share_name = share['id'].replace('-', '')
 
-        if self._check_share_exist(pool_name, share_name):
-            command_line = ['folder', 'options', pool_data['id'],
-                            folder_name, '-d', share_name]
-            self._execute(command_line)
-        else:
+        if not self._check_share_exist(pool_name, share_name):
             LOG.warning('Share [%(share_name)s] is already deleted.', {
                 'share_name': share_name})
+        elif self.delete_queue_path:
+            if {'pool': pool_name, 'share': share_name} in self.delete_queue:
+                LOG.info('Share [%(share_name)s] is already queued to be '
+                         'deleted.', {'share_name': share_name})
+                return
+            # Stop exporting the share now, the folder is deleted later.
+            share_path = pool_data['path'] + share_name
+            share_proto = share['share_proto'].lower()
+            try:
+                self._execute(['share', share_path, share_proto, 'off'])
+            except exception.InfortrendNASException as e:
+                if not self._check_deleted_outside(pool_name, share_name, e):
+                    raise
+                return
+            self._queue_delete(pool_name, share_name)
+        else:
+            self._delete_folder(pool_name, share_name, folder_name)
 
         LOG.info('Delete Share [%(share)s] completed.', {
             'share': share['id']})
 
-    def _check_share_exist(self, pool_name, share_name):
+    def _delete_folder(self, pool_name, share_name, folder_name=None):
+        pool_data = self._get_share_pool_data(pool_name)
+        folder_name = folder_name or self._extract_lv_name(pool_data)
+        command_line = ['folder', 'options', pool_data['id'],
+                        folder_name, '-d', share_name]
+        try:
+            self._execute(command_line)
+        except exception.InfortrendNASException as e:
+            self.quota_drift.add(pool_name)
+            if not self._check_deleted_outside(pool_name, share_name, e):
+                raise
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self.quota_drift.add(pool_name)
+        self._update_share_index(pool_name, remove=share_name)
+        self._update_quota_index(pool_name, share_name, remove=True)
+
+    def _check_deleted_outside(self, pool_name, share_name, error):
+        # The index may still list a folder removed outside of the driver.
+        if isinstance(error, NASUnreachableException):
+            return False
+        if self._check_share_exist(pool_name, share_name, refresh=True):
+            return False
+        LOG.warning('Share [%(share_name)s] is already deleted, '
+                    'reason: %(e)s.', {'share_name': share_name, 'e': error})
+        return True
+
+    def _queue_delete(self, pool_name, share_name):
+        self.delete_queue.append({'pool': pool_name, 'share': share_name})
+        self._save_delete_queue()
+        LOG.debug('Share [%(share)s] queued to be deleted, queue depth '
+                  '%(depth)s.', {'share': share_name,
+                                 'depth': len(self.delete_queue)})
+
+    def _load_delete_queue(self):
+        if not os.path.exists(self.delete_queue_path):
+            return []
+        try:
+            with open(self.delete_queue_path) as queue_file:
+                return json.load(queue_file)
+        except (IOError, ValueError) as e:
+            msg = _('Failed to load delete queue [%(path)s], '
+                    'reason: %(e)s.') % {
+                        'path': self.delete_queue_path, 'e': e}
+            LOG.error(msg)
+            raise exception.InfortrendNASException(err=msg)
+
+    def _save_delete_queue(self):
+        # Write a new file and rename it, so the queue survives a crash.
+        tmp_path = self.delete_queue_path + '.tmp'
+        with open(tmp_path, 'w') as queue_file:
+            json.dump(self.delete_queue, queue_file)
+        os.rename(tmp_path, self.delete_queue_path)
+
+    def _start_delete_worker(self):
+        self.delete_queue = self._load_delete_queue()
+        if not self.delete_worker:
+            self.delete_worker = loopingcall.FixedIntervalLoopingCall(
+                self._process_delete_queue)
+            self.delete_worker.start(interval=self._DELETE_QUEUE_INTERVAL)
+
+    def _process_delete_queue(self):
+        # Failed deletes stay queued and are retried next time.
+        entries = list(self.delete_queue)
+        if not entries:
+            return
+
+        def _delete(entry):
+            if self._check_share_exist(entry['pool'], entry['share']):
+                self._delete_folder(entry['pool'], entry['share'])
+
+        results = self._run_concurrently(
+            _delete, entries, self.delete_concurrency)
+        for entry, result in zip(entries, results):
+            if isinstance(result, BaseException):
+                LOG.warning('Failed to delete folder [%(share)s] in pool '
+                            '[%(pool)s], retry later, reason: %(e)s.', {
+                                'share': entry['share'],
+                                'pool': entry['pool'], 'e': result})
+            else:
+                self.delete_queue.remove(entry)
+        try:
+            self._save_delete_queue()
+        except (IOError, OSError) as e:
+            LOG.warning('Failed to save delete queue, reason: %(e)s.',
+                        {'e': e})
+
+        LOG.info('Delete queue depth: %s.', len(self.delete_queue))
+
+    def _get_share_names(self, pool_name):
         path = self.pool_dict[pool_name]['path']
         command_line = ['pagelist', 'folder', path]
         rc, subfolders = self._execute(command_line)
-        return any(subfolder['name'] == share_name for subfolder in subfolders)
+        return set(subfolder['name'] for subfolder in subfolders)
+
+    def _check_share_exist(self, pool_name, share_name, refresh=False):
+        # Folders may be changed outside of the driver, so a missing share
+        # rebuilds the index of its pool once before it is reported.
+        if refresh:
+            self.share_cache.invalidate(pool_name)
+        share_names = self.share_cache.lookup(
+            pool_name, lambda: self._get_share_names(pool_name),
+            lambda names: share_name in names)
+        return share_name in share_names
+
+    def _update_share_index(self, pool_name, add=None, remove=None):
+        share_names = self.share_cache.peek(pool_name)
+        if share_names is None:
+            return
+        if remove:
+            share_names.discard(remove)
+        if add:
+            share_names.add(add)
 
     def update_access(self, share, access_rules, add_rules,
                       delete_rules, share_server=None):
-        self._evict_unauthorized_clients(share, access_rules, share_server)
-        access_dict = {}
-        for access in access_rules:
+        if add_rules or delete_rules:
+            # Only the changes are applied, other rules are already on NAS.
+            self._deny_access(
+                share, [access['access_to'] for access in delete_rules])
+            allow_rules = add_rules
+        else:
+            # Recovery mode, resync NAS with all rules.
+            allow_rules = self._reconcile_access(
+                share, access_rules, share_server)
+
+        failed_rules = self._allow_access_rules(share, allow_rules)
+        return {access['id']: 'error' for access in failed_rules}
+
+    def _run_concurrently(self, func, args_list, size=None, timeout=None):
+        # At most size calls run at once, each holding a pooled SSH session.
+        # Results keep the order of args_list, with the exception raised by
+        # a call, or the eventlet Timeout, in place of its result.
+        def _call(args):
             try:
-                self._allow_access(share, access, share_server)
-            except (exception.InfortrendNASException) as e:
-                msg = _('Failed to allow access to client %(access)s, '
-                        'reason %(e)s.') % {
-                            'access': access['access_to'], 'e': e}
-                LOG.error(msg)
-                access_dict[access['id']] = 'error'
+                with eventlet_timeout.Timeout(timeout):
+                    return func(args)
+            except (Exception, eventlet_timeout.Timeout) as e:
+                return e
 
-        return access_dict
+        pool = greenpool.GreenPool(size or self.ssh_pool_size)
+        return list(pool.imap(_call, args_list))
 
-    def _evict_unauthorized_clients(self, share, access_rules,
-                                    share_server=None):
+    def _reconcile_access(self, share, access_rules, share_server=None):
+        # Read access on NAS once, remove unauthorized clients and return
+        # the rules that are new or whose access level changed.
         pool_name = share_utils.extract_host(share['host'], level='pool')
         pool_data = self._get_share_pool_data(pool_name)
         share_proto = share['share_proto'].lower()
         share_name = share['id'].replace('-', '')
         share_path = pool_data['path'] + share_name
 
-        access_list = []
-        for access in access_rules:
-            access_list.append(access['access_to'])
+        current_access = self._get_current_access(share_path, share_proto)
+        access_levels = {
+            access['access_to']:
+                access['access_level'] or constants.ACCESS_LEVEL_RW
+            for access in access_rules
+        }
 
+        evict_list = [access_to for access_to in current_access
+                      if access_to not in access_levels]
+        allow_rules = [
+            access for access in access_rules
+            if (current_access.get(access['access_to']) !=
+                access_levels[access['access_to']])
+        ]
+        LOG.debug('Reconcile access of share [%(share)s], evict: %(evict)s, '
+                  'allow: %(allow)s.', {
+                      'share': share['id'],
+                      'evict': evict_list,
+                      'allow': [access['access_to']
+                                for access in allow_rules]})
+
+        self._deny_access(share, evict_list)
+        return allow_rules
+
+    def _get_current_access(self, share_path, share_proto):
+        current_access = {}
         if share_proto == 'nfs':
-            host_ip_list = []
             command_line = ['share', 'status', '-f', share_path]
             rc, nfs_status = self._execute(command_line)
             host_list = nfs_status[0]['nfs_detail']['hostList']
             for host in host_list:
                 if host['host'] != '*':
-                    host_ip_list.append(host['host'])
-            for ip in host_ip_list:
-                if ip not in access_list:
-                    command_line = ['share', 'options', share_path,
-                                    'nfs', '-c', ip]
-                    try:
-                        self._execute(command_line)
-                    except exception.InfortrendNASException:
-                        msg = _("Failed to remove share access rule %s") % (ip)
-                        LOG.exception(msg)
-                        pass
+                    current_access[host['host']] = host['access']
 
         elif share_proto == 'cifs':
-            host_user_list = []
             command_line = ['acl', 'get', share_path]
             rc, cifs_status = self._execute(command_line)
             for cifs_rule in cifs_status:
                 if cifs_rule['name']:
-                    host_user_list.append(cifs_rule['name'])
-            for user in host_user_list:
-                if user not in access_list:
-                    command_line = ['acl', 'delete', share_path, '-u', user]
-                    try:
-                        self._execute(command_line)
-                    except exception.InfortrendNASException:
-                        msg = _("Failed to remove share access rule %s") % (
-                            user)
-                        LOG.exception(msg)
-                        pass
-
-    def _allow_access(self, share, access, share_server=None):
+                    if cifs_rule['permission']['Write']:
+                        access_level = constants.ACCESS_LEVEL_RW
+                    else:
+                        access_level = constants.ACCESS_LEVEL_RO
+                    current_access[cifs_rule['name']] = access_level
+
+        return current_access
+
+    def _deny_access(self, share, access_to_list):
         pool_name = share_utils.extract_host(share['host'], level='pool')
         pool_data = self._get_share_pool_data(pool_name)
+        share_proto = share['share_proto'].lower()
         share_name = share['id'].replace('-', '')
         share_path = pool_data['path'] + share_name
-        share_proto = share['share_proto'].lower()
-        access_type = access['access_type']
-        access_level = access['access_level'] or constants.ACCESS_LEVEL_RW
-        access_to = access['access_to']
-        ACCESS_LEVEL_MAP = {access_level: access_level}
-        msg = self._check_access_legal(share_proto, access_type)
-        if msg:
-            raise exception.InvalidShareAccess(reason=msg)
 
-        if share_proto == 'nfs':
-            command_line = ['share', 'options', share_path, 'nfs',
-                            '-h', access_to, '-p', access_level]
-            self._execute(command_line)
-
-        elif share_proto == 'cifs':
-            if not self._check_user_exist(access_to):
-                msg = _('Please create user [%(user)s] in advance.') % {
-                    'user': access_to}
+        command_lines = []
+        for access_to in access_to_list:
+            if share_proto == 'nfs':
+                command_lines.append(['share', 'options', share_path,
+                                      'nfs', '-c', access_to])
+            elif share_proto == 'cifs':
+                command_lines.append(['acl', 'delete', share_path,
+                                      '-u', access_to])
+
+        results = self._run_concurrently(self._execute, command_lines)
+        for access_to, result in zip(access_to_list, results):
+            if isinstance(result, NASUnreachableException):
+                raise result
+            elif isinstance(result, (exception.InfortrendNASException,
+                                     exception.InfortrendCLIException)):
+                # Rules that never reached NAS are rejected on delete.
+                msg = _("Failed to remove share access rule %(access)s, "
+                        "reason %(e)s.") % {
+                            'access': access_to, 'e': result}
                 LOG.error(msg)
-                raise exception.InfortrendNASException(err=msg)
+            elif isinstance(result, Exception):
+                raise result
 
-            if access_level == constants.ACCESS_LEVEL_RW:
-                cifs_access = 'f'
-            elif access_level == constants.ACCESS_LEVEL_RO:
-                cifs_access = 'r'
-            try:
-                access_level = ACCESS_LEVEL_MAP[access_level]
-            except KeyError:
+    def _allow_access_rules(self, share, access_rules):
+        # Rules of one access level are sent as a bulk command, and sent
+        # again one per rule if NAS rejects it. Return the failed rules.
+        pool_name = share_utils.extract_host(share['host'], level='pool')
+        pool_data = self._get_share_pool_data(pool_name)
+        share_name = share['id'].replace('-', '')
+        share_path = pool_data['path'] + share_name
+        share_proto = share['share_proto'].lower()
+
+        failed_rules = []
+        level_rules = {}
+        for access in access_rules:
+            msg = self._check_access_legal(share_proto, access['access_type'])
+            if msg:
+                raise exception.InvalidShareAccess(reason=msg)
+
+            access_level = access['access_level'] or constants.ACCESS_LEVEL_RW
+            if access_level not in self._CIFS_ACCESS_MAP:
                 msg = _('Unsupported access_level: [%s].') % access_level
                 raise exception.InvalidInput(msg)
 
-            command_line = ['acl', 'set', share_path,
-                            '-u', access_to, '-a', cifs_access]
-            self._execute(command_line)
+            if (share_proto == 'cifs' and
+                    not self._check_user_exist(access['access_to'])):
+                LOG.error('Please create user [%(user)s] in advance.', {
+                    'user': access['access_to']})
+                failed_rules.append(access)
+                continue
 
-        LOG.info('Share [%(share)s] access to [%(access_to)s] '
-                 'level [%(level)s] protocol [%(share_proto)s] completed.', {
-                     'share': share['id'],
-                     'access_to': access_to,
-                     'level': access_level,
-                     'share_proto': share_proto})
+            level_rules.setdefault(access_level, []).append(access)
+
+        for access_level, rules in level_rules.items():
+            for index in range(0, len(rules), self._BULK_ACCESS_SIZE):
+                failed_rules.extend(self._allow_access_bulk(
+                    share_path, share_proto, access_level,
+                    rules[index:index + self._BULK_ACCESS_SIZE]))
+
+        for access in access_rules:
+            if access not in failed_rules:
+                LOG.info('Share [%(share)s] access to [%(access_to)s] '
+                         'level [%(level)s] protocol [%(share_proto)s] '
+                         'completed.', {
+                             'share': share['id'],
+                             'access_to': access['access_to'],
+                             'level': (access['access_level'] or
+                                       constants.ACCESS_LEVEL_RW),
+                             'share_proto': share_proto})
+
+        return failed_rules
+
+    def _allow_access_bulk(self, share_path, share_proto, access_level,
+                           rules):
+        access_to_list = [access['access_to'] for access in rules]
+        try:
+            self._execute(self._get_allow_command(
+                share_path, share_proto, access_level, access_to_list))
+            return []
+        except NASUnreachableException as e:
+            for access_to in access_to_list:
+                self._log_allow_failure(access_to, e)
+            return rules
+        except (exception.InfortrendNASException,
+                exception.InfortrendCLIException) as e:
+            # A non-zero exit code of NASCLI raises InfortrendNASException.
+            if len(rules) == 1:
+                self._log_allow_failure(access_to_list[0], e)
+                return rules
+            LOG.warning('NAS rejected bulk access to %(access)s, '
+                        'apply them one by one, reason %(e)s.', {
+                            'access': access_to_list, 'e': e})
+
+        command_lines = [
+            self._get_allow_command(
+                share_path, share_proto, access_level, [access_to])
+            for access_to in access_to_list
+        ]
+        try:
+            results = self._execute_batch(command_lines, raise_error=False)
+        except exception.InfortrendNASException as e:
+            results = [(None, e)] * len(rules)
+
+        failed_rules = []
+        for access, (rc, out) in zip(rules, results):
+            if rc != 0:
+                self._log_allow_failure(access['access_to'], out)
+                failed_rules.append(access)
+        return failed_rules
+
+    def _get_allow_command(self, share_path, share_proto, access_level,
+                           access_to_list):
+        access_to = ','.join(access_to_list)
+        if share_proto == 'nfs':
+            return ['share', 'options', share_path, 'nfs',
+                    '-h', access_to, '-p', access_level]
+        elif share_proto == 'cifs':
+            return ['acl', 'set', share_path, '-u', access_to,
+                    '-a', self._CIFS_ACCESS_MAP[access_level]]
+
+    def _log_allow_failure(self, access_to, reason):
+        msg = _('Failed to allow access to client %(access)s, '
+                'reason %(e)s.') % {'access': access_to, 'e': reason}
+        LOG.error(msg)
 
     def _ensure_protocol_on(self, share_path, share_proto, cifs_name):
         if not self._check_proto_enabled(share_path, share_proto):
-            command_line = ['share', share_path, share_proto, 'on']
-            if share_proto == 'cifs':
-                command_line.extend(['-n', cifs_name])
+            command_line = self._get_protocol_on_command(
+                share_path, share_proto, cifs_name)
             self._execute(command_line)
 
+    def _get_protocol_on_command(self, share_path, share_proto, cifs_name):
+        command_line = ['share', share_path, share_proto, 'on']
+        if share_proto == 'cifs':
+            command_line.extend(['-n', cifs_name])
+        return command_line
+
     def _check_proto_enabled(self, share_path, share_proto):
         command_line = ['share', 'status', '-f', share_path]
         rc, share_status = self._execute(command_line)
@@ -476,12 +1442,16 @@ class InfortrendNAS(object):
         return False
 
     def _check_user_exist(self, user_name):
-        command_line = ['useradmin', 'user', 'list']
-        rc, user_list = self._execute(command_line)
-        for user in user_list:
-            if user['Name'] == user_name:
-                return True
-        return False
+        def _get_user_names():
+            command_line = ['useradmin', 'user', 'list']
+            rc, user_list = self._execute(command_line)
+            return set(user['Name'] for user in user_list)
+
+        # User may be created after the cached list was read, so a missing
+        # user reloads the list once before it is rejected.
+        user_names = self.user_cache.lookup(
+            'users', _get_user_names, lambda names: user_name in names)
+        return user_name in user_names
 
     def _check_access_legal(self, share_proto, access_type):
         msg = None
@@ -511,6 +1481,76 @@ class InfortrendNAS(object):
         return self._export_location(
             share_name, share_proto, pool_data['path'])
 
+    def get_backend_info(self, version):
+        # The share manager skips ensuring shares while this is unchanged.
+        pools = ['%s:%s:%s' % (pool_name,
+                               self.pool_dict[pool_name]['id'],
+                               self.pool_dict[pool_name]['path'])
+                 for pool_name in sorted(self.pool_dict)]
+        channels = ['%s:%s' % (ch, self.channel_dict[ch])
+                    for ch in sorted(self.channel_dict)]
+        return {
+            'version': version,
+            'nas_ip': self.nas_ip,
+            'pools': ','.join(pools),
+            'channels': ','.join(channels),
+        }
+
+    def ensure_shares(self, shares):
+        # Read channels once, and list folders of each pool once with
+        # ensure_check_exist.
+        self._refresh_channels_status(force=True)
+
+        share_names = {}
+        if self.ensure_check_exist:
+            pool_names = set(
+                share_utils.extract_host(share['host'], level='pool')
+                for share in shares)
+            for pool_name in pool_names & set(self.pool_dict):
+                try:
+                    share_names[pool_name] = self._get_share_names(pool_name)
+                except (exception.InfortrendNASException,
+                        exception.InfortrendCLIException) as e:
+                    LOG.warning('Failed to list shares of pool [%(pool)s], '
+                                'skip checking them, reason %(e)s.', {
+                                    'pool': pool_name, 'e': e})
+                    continue
+                self.share_cache.set(pool_name, share_names[pool_name])
+
+        updates = {}
+        for share in shares:
+            share_name = share['id'].replace('-', '')
+            share_proto = share['share_proto'].lower()
+            pool_name = share_utils.extract_host(share['host'], level='pool')
+            try:
+                pool_data = self._get_share_pool_data(pool_name)
+                if (pool_name in share_names and
+                        share_name not in share_names[pool_name]):
+                    msg = _('Share [%(share)s] not found in pool '
+                            '[%(pool)s].') % {
+                                'share': share['id'], 'pool': pool_name}
+                    raise exception.InfortrendNASException(err=msg)
+                export_locations = self._export_location(
+                    share_name, share_proto, pool_data['path'], refresh=False)
+            except (exception.InfortrendNASException,
+                    exception.InvalidHost,
+                    exception.InvalidInput) as e:
+                LOG.error('Failed to ensure share [%(share)s], '
+                          'reason %(e)s.', {'share': share['id'], 'e': e})
+                updates[share['id']] = {
+                    'status': constants.STATUS_ERROR,
+                    'reapply_access_rules': False,
+                }
+                continue
+
+            updates[share['id']] = {
+                'export_locations': export_locations,
+                'status': constants.STATUS_AVAILABLE,
+                'reapply_access_rules': False,
+            }
+
+        return updates
+
     def extend_share(self, share, new_size, share_server=None):
         pool_name = share_utils.extract_host(share['host'], level='pool')
         pool_data = self._get_share_pool_data(pool_name)
@@ -526,15 +1566,11 @@ class InfortrendNAS(object):
         pool_name = share_utils.extract_host(share['host'], level='pool')
         pool_data = self._get_share_pool_data(pool_name)
         share_name = share['id'].replace('-', '')
-        folder_name = self._extract_lv_name(pool_data)
 
-        command_line = ['fquota', 'status', pool_data['id'],
-                        folder_name, '-t', 'folder']
-        rc, quota_status = self._execute(command_line)
-
-        for share_quota in quota_status:
-            if share_quota['name'] == share_name:
-                used_space = round(_bi_to_gi(float(share_quota['used'])), 2)
+        # Data loss check needs current usage, refresh the index for it.
+        share_quota = self._get_pool_quota(pool_name, refresh=True).get(
+            share_name, {'used': 0.0})
+        used_space = round(_bi_to_gi(share_quota['used']), 2)
 
         if new_size < used_space:
             raise exception.ShareShrinkingPossibleDataLoss(
@@ -588,6 +1624,9 @@ class InfortrendNAS(object):
         command_line = ['folder', 'options', pool_data['id'], volume_name,
                         '-k', folder_name, share_name]
         self._execute(command_line)
+        self._update_share_index(
+            pool_name, add=share_name, remove=folder_name)
+        self._update_quota_index(pool_name, folder_name, rename=share_name)
 
         location = self._export_location(
             share_name, share_proto, pool_data['path'])
@@ -627,7 +1666,12 @@ class InfortrendNAS(object):
         return ip, folder_name
 
     def _check_channel_ip(self, channel_ip):
-        return any(ip == channel_ip for ip in self.channel_dict.values())
+        if channel_ip in self.channel_dict.values():
+            return True
+
+        # Channel IP may be changed since last check, refresh it once.
+        self._refresh_channels_status(force=True)
+        return channel_ip in self.channel_dict.values()
 
     def unmanage(self, share):
         pool_name = share_utils.extract_host(share['host'], level='pool')
@@ -73,6 +73,18 @@ class InfortrendNASTestData(object):
                                '"mounted": true, '
                                '"size": "107321753600"}]}\n\n')
 
+    fake_succeed_data = ('(64175, 1234, 90, 0)\n\n'
+                         '{"cliCode": '
+                         '[{"Return": "0x0000", "CLI": "Successful"}], '
+                         '"returnCode": [], '
+                         '"data": []}\n\n')
+
+    fake_cli_error_data = ('(64175, 1234, 97, 0)\n\n'
+                           '{"cliCode": '
+                           '[{"Return": "0x000c", "CLI": "Invalid param"}], '
+                           '"returnCode": [], '
+                           '"data": []}\n\n')
+
     fake_nfs_status_off = [{
         'A': {
             'NFS': {
@@ -118,6 +130,21 @@ class InfortrendNASTestData(object):
         'size': '107321753600',
     }]
 
+    def fake_get_service_status(self, proto, cpu_rate, mem_rate):
+        return [{
+            'A': {
+                proto.upper(): {
+                    'displayName': proto.upper(),
+                    'state_time': '2017-05-04 14:19:53',
+                    'enabled': True,
+                    'cpu_rate': cpu_rate,
+                    'mem_rate': mem_rate,
+                    'state': 'running',
+                    'type': 'share',
+                }
+            }
+        }]
+
     def fake_get_channel_status(self, ch1_status='UP'):
         return [{
             'datalink': 'mgmt0',
@@ -13,7 +13,12 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import json
+import os
+
 import ddt
+import eventlet
+import fixtures
 import mock
 
 from oslo_config import cfg
@@ -48,6 +53,17 @@ class InfortrendNASDriverTestCase(test.TestCase):
         CONF.set_default('infortrend_nas_ssh_key', 'fake_sshkey')
         CONF.set_default('infortrend_share_pools', 'share-pool-01')
         CONF.set_default('infortrend_share_channels', '0,1')
+        CONF.set_default('infortrend_ssh_pool_size', 4)
+        CONF.set_default('infortrend_nascli_session', False)
+        CONF.set_default('infortrend_stats_pool_timeout', 20)
+        CONF.set_default('infortrend_pool_cache_ttl', 300)
+        CONF.set_default('infortrend_quota_cache_ttl', 60)
+        CONF.set_default('infortrend_ensure_shares_check_exist', False)
+        CONF.set_default('infortrend_async_delete', False)
+        CONF.set_default('infortrend_quota_sweep_interval', 10)
+        CONF.set_default('infortrend_thin_provisioning', False)
+        CONF.set_default('infortrend_stats_refresh_interval', 0)
+        CONF.set_default('infortrend_stats_max_staleness', 300)
         self.fake_conf = configuration.Configuration(None)
         super(InfortrendNASDriverTestCase, self).setUp()
 
@@ -79,6 +95,261 @@ class InfortrendNASDriverTestCase(test.TestCase):
             self._get_driver,
             self.fake_conf)
 
+    @ddt.data(300, 600)
+    def test_stats_refresh_interval_not_less_than_staleness(self, interval):
+        self.fake_conf.set_default('infortrend_stats_refresh_interval',
+                                   interval)
+
+        self.assertRaises(
+            exception.InvalidParameterValue,
+            self._get_driver,
+            self.fake_conf)
+
+    @mock.patch.object(infortrend_nas.manila_utils, 'SSHPool')
+    def test_init_connect_with_pool_size(self, mock_sshpool):
+        self.fake_conf.set_default('infortrend_ssh_pool_size', 3)
+        self._get_driver(self.fake_conf)
+
+        self._iftnas._init_connect()
+        self._iftnas._init_connect()
+
+        mock_sshpool.assert_called_once_with(
+            ip='172.27.1.1', port=22, conn_timeout=30,
+            login='fake_user', password='fake_password',
+            privatekey='fake_sshkey', min_size=3, max_size=3)
+
+    @mock.patch.object(infortrend_nas.processutils, 'ssh_execute')
+    def test_ssh_execute_checks_out_pooled_session(self, mock_ssh_execute):
+        self._get_driver(self.fake_conf)
+        fake_ssh = mock.Mock()
+        self._iftnas.sshpool = mock.Mock()
+        self._iftnas.sshpool.item.return_value.__enter__ = mock.Mock(
+            return_value=fake_ssh)
+        self._iftnas.sshpool.item.return_value.__exit__ = mock.Mock(
+            return_value=False)
+        mock_ssh_execute.return_value = (
+            self.nas_data.fake_service_status_data, '')
+
+        out = self._iftnas._ssh_execute('service status nfs -z a@0')
+
+        self.assertEqual(self.nas_data.fake_service_status_data, out)
+        mock_ssh_execute.assert_called_once_with(
+            fake_ssh, 'service status nfs -z a@0',
+            timeout=30, check_exit_code=True)
+        self._iftnas.sshpool.item.return_value.__exit__.assert_called_once()
+
+    def test_nascli_session_frames_response(self):
+        fake_ssh = mock.Mock()
+        fake_channel = fake_ssh.invoke_shell.return_value
+        fake_channel.recv.side_effect = [
+            b'NASCLI> service status nfs -z a@0\r\n(64175, 1234, ',
+            self.nas_data.fake_service_status_data[14:].encode(),
+        ]
+        session = infortrend_nas.NASCLISession(fake_ssh, 30)
+
+        out = session.execute('service status nfs -z a@0')
+
+        fake_channel.sendall.assert_called_once_with(
+            'service status nfs -z a@0\n')
+        self.assertEqual(
+            self.nas_data.fake_service_status_data.strip() + '\n', out)
+
+    def test_ssh_execute_with_nascli_session(self):
+        self.fake_conf.set_default('infortrend_nascli_session', True)
+        self._get_driver(self.fake_conf)
+        fake_ssh = mock.Mock()
+        self._iftnas.sshpool = mock.MagicMock()
+        self._iftnas.sshpool.item.return_value.__enter__.return_value = (
+            fake_ssh)
+        fake_channel = fake_ssh.invoke_shell.return_value
+        fake_channel.closed = False
+        fake_channel.recv.side_effect = [
+            self.nas_data.fake_service_status_data.encode(),
+            self.nas_data.fake_folder_status_data.encode(),
+        ]
+
+        rc, service_status = self._iftnas._execute(['service', 'status'])
+        rc, folder_status = self._iftnas._execute(['folder', 'status'])
+
+        fake_ssh.invoke_shell.assert_called_once_with()
+        self.assertEqual(2, len(folder_status))
+        fake_channel.sendall.assert_has_calls([
+            mock.call('service status -z a@0\n'),
+            mock.call('folder status -z a@0\n')])
+
+    def test_nascli_session_closed_on_error(self):
+        self.fake_conf.set_default('infortrend_nascli_session', True)
+        self._get_driver(self.fake_conf)
+        fake_ssh = mock.Mock()
+        self._iftnas.sshpool = mock.MagicMock()
+        self._iftnas.sshpool.item.return_value.__enter__.return_value = (
+            fake_ssh)
+        fake_channel = fake_ssh.invoke_shell.return_value
+        fake_channel.recv.side_effect = IOError('timed out')
+
+        self.assertRaises(
+            exception.InfortrendNASException,
+            self._iftnas._ssh_execute,
+            'folder status -z a@0')
+        fake_channel.close.assert_called_once_with()
+        self.assertNotIn(fake_ssh, self._iftnas.cli_sessions)
+
+    def test_execute_batch(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas._ssh_execute = mock.Mock(return_value=(
+            self.nas_data.fake_succeed_data +
+            self.nas_data.fake_folder_status_data))
+
+        results = self._iftnas._execute_batch([
+            ['folder', 'options', self.nas_data.fake_share_name[0]],
+            ['folder', 'status'],
+        ])
+
+        self._iftnas._ssh_execute.assert_called_once_with(
+            'folder options %s -z a@0\nfolder status -z a@0' %
+            self.nas_data.fake_share_name[0], check_exit_code=False)
+        self.assertEqual(SUCCEED, results[0])
+        self.assertEqual(0, results[1][0])
+        self.assertEqual(2, len(results[1][1]))
+
+    def test_execute_batch_with_error(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas._ssh_execute = mock.Mock(return_value=(
+            self.nas_data.fake_succeed_data +
+            self.nas_data.fake_cli_error_data))
+        command_lines = [['folder', 'status'],
+                         ['fquota', 'create'],
+                         ['share', 'status']]
+
+        results = self._iftnas._execute_batch(
+            command_lines, raise_error=False)
+
+        self.assertEqual(SUCCEED, results[0])
+        self.assertEqual((12, 'Invalid param'), results[1])
+        self.assertIsNone(results[2][0])
+        self.assertRaisesRegex(
+            exception.InfortrendNASException,
+            r'fquota create -z a@0\] \(2 of 3\)',
+            self._iftnas._execute_batch,
+            [['folder', 'status'], ['fquota', 'create'], ['share', 'status']])
+
+    @ddt.data('(64175, 1234, 90, 0)\n',
+              '(64175, 1234, 90, 0)\n\n{"data": []}\n')
+    def test_execute_batch_with_truncated_response(self, response):
+        self._get_driver(self.fake_conf)
+        self._iftnas._ssh_execute = mock.Mock(
+            return_value=self.nas_data.fake_succeed_data + response)
+
+        results = self._iftnas._execute_batch(
+            [['folder', 'status'], ['share', 'status']], raise_error=False)
+
+        self.assertEqual(SUCCEED, results[0])
+        self.assertIsNone(results[1][0])
+        self.assertRaisesRegex(
+            exception.InfortrendNASException,
+            r'share status -z a@0\] \(2 of 2\)',
+            self._iftnas._execute_batch,
+            [['folder', 'status'], ['share', 'status']])
+
+    def test_init_controllers(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas._execute = mock.Mock(return_value=(0, [{
+            'A': self.nas_data.fake_nfs_status_off[0]['A'],
+            'B': self.nas_data.fake_nfs_status_off[0]['A'],
+        }]))
+
+        self._iftnas._init_controllers()
+
+        self.assertEqual(['a@0', 'b@0'], self._iftnas.locations)
+
+    def test_execute_read_only_commands_on_both_controllers(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas.locations = ['a@0', 'b@0']
+        self._iftnas._ssh_execute = mock.Mock(
+            return_value=self.nas_data.fake_folder_status_data)
+
+        self._iftnas._execute(['folder', 'status'])
+        self._iftnas._execute(['folder', 'status'])
+        self._iftnas._execute(['folder', 'options', '-c', 'fake'])
+
+        self._iftnas._ssh_execute.assert_has_calls([
+            mock.call('folder status -z b@0'),
+            mock.call('folder status -z a@0'),
+            mock.call('folder options -c fake -z a@0')])
+
+    @mock.patch.object(infortrend_nas.LOG, 'warning')
+    def test_execute_failover_to_other_controller(self, log_warning):
+        self._get_driver(self.fake_conf)
+        self._iftnas.locations = ['a@0', 'b@0']
+        self._iftnas.read_index = 1
+        self._iftnas._ssh_execute = mock.Mock(side_effect=[
+            infortrend_nas.NASUnreachableException(err='fake error'),
+            self.nas_data.fake_folder_status_data,
+            self.nas_data.fake_succeed_data,
+        ])
+
+        rc, folder_status = self._iftnas._execute(['folder', 'status'])
+        self._iftnas._execute(['folder', 'options', '-c', 'fake'])
+
+        self.assertEqual(2, len(folder_status))
+        self._iftnas._ssh_execute.assert_has_calls([
+            mock.call('folder status -z a@0'),
+            mock.call('folder status -z b@0'),
+            mock.call('folder options -c fake -z a@0')])
+        self.assertEqual(1, log_warning.call_count)
+
+    def test_execute_write_unreachable_without_failover(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas.locations = ['a@0', 'b@0']
+        self._iftnas._ssh_execute = mock.Mock(side_effect=[
+            infortrend_nas.NASUnreachableException(err='timeout'),
+            self.nas_data.fake_succeed_data,
+        ])
+
+        self.assertRaises(infortrend_nas.NASUnreachableException,
+                          self._iftnas._execute,
+                          ['folder', 'options', '-c', 'fake'])
+        self._iftnas._execute(['folder', 'options', '-c', 'fake'])
+
+        self._iftnas._ssh_execute.assert_has_calls([
+            mock.call('folder options -c fake -z a@0'),
+            mock.call('folder options -c fake -z a@0')])
+        self.assertEqual({}, self._iftnas.controller_down_until)
+
+    @mock.patch.object(infortrend_nas.LOG, 'warning')
+    def test_execute_command_error_without_failover(self, log_warning):
+        self._get_driver(self.fake_conf)
+        self._iftnas.locations = ['a@0', 'b@0']
+        self._iftnas.read_index = 1
+        self._iftnas._ssh_execute = mock.Mock(side_effect=[
+            exception.InfortrendNASException(err='fake error'),
+            self.nas_data.fake_cli_error_data,
+            self.nas_data.fake_succeed_data,
+        ])
+
+        self.assertRaises(exception.InfortrendNASException,
+                          self._iftnas._execute,
+                          ['folder', 'options', '-d', 'fake'])
+        self.assertRaises(exception.InfortrendCLIException,
+                          self._iftnas._execute, ['folder', 'status'])
+        self._iftnas._execute(['folder', 'options', '-c', 'fake'])
+
+        self._iftnas._ssh_execute.assert_has_calls([
+            mock.call('folder options -d fake -z a@0'),
+            mock.call('folder status -z a@0'),
+            mock.call('folder options -c fake -z a@0')])
+        self.assertEqual({}, self._iftnas.controller_down_until)
+        log_warning.assert_not_called()
+
+    @mock.patch.object(infortrend_nas.processutils, 'ssh_execute')
+    def test_ssh_execute_connection_error(self, mock_ssh_execute):
+        self._get_driver(self.fake_conf)
+        self._iftnas.sshpool = mock.MagicMock()
+        mock_ssh_execute.side_effect = IOError('timed out')
+
+        self.assertRaises(infortrend_nas.NASUnreachableException,
+                          self._iftnas._ssh_execute, 'folder status -z a@0')
+
     def test_parser_with_service_status(self):
         self._get_driver(self.fake_conf)
         expect_service_status = [{
@@ -174,6 +445,50 @@ class InfortrendNASDriverTestCase(test.TestCase):
 
         self.assertEqual(1, log_warning.call_count)
 
+    def test_export_location_with_channel_cache(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas._execute = mock.Mock(
+            return_value=(0, self.nas_data.fake_get_channel_status()))
+
+        self._iftnas._export_location('fake_share', 'nfs', '/fake/')
+        self._iftnas._export_location('fake_share', 'nfs', '/fake/')
+
+        self._iftnas._execute.assert_called_once_with(
+            ['ifconfig', 'inet', 'show'])
+
+    @mock.patch.object(infortrend_nas.LOG, 'warning')
+    def test_export_location_refresh_down_channel(self, log_warning):
+        self._get_driver(self.fake_conf)
+        self._iftnas._execute = mock.Mock(side_effect=[
+            (0, self.nas_data.fake_get_channel_status('DOWN')),
+            (0, self.nas_data.fake_get_channel_status()),
+            (0, self.nas_data.fake_get_channel_status()),
+        ])
+
+        self._iftnas._export_location('fake_share', 'nfs', '/fake/')
+        self._iftnas._export_location('fake_share', 'nfs', '/fake/')
+        self._iftnas._export_location('fake_share', 'nfs', '/fake/')
+
+        self.assertEqual(2, self._iftnas._execute.call_count)
+        self.assertEqual(set(), self._iftnas.channels_down)
+
+    @mock.patch.object(infortrend_nas.loopingcall,
+                       'FixedIntervalLoopingCall')
+    def test_check_for_setup_error_starts_channel_refresher(
+            self, mock_loopingcall):
+        self._get_driver(self.fake_conf)
+        self._iftnas._execute = mock.Mock(side_effect=[
+            (0, self.nas_data.fake_folder_status),
+            (0, self.nas_data.fake_get_channel_status()),
+        ])
+
+        self._driver.check_for_setup_error()
+
+        mock_loopingcall.assert_called_once_with(
+            self._iftnas._refresh_channels_in_background)
+        mock_loopingcall.return_value.start.assert_called_once_with(
+            interval=60, initial_delay=60)
+
     @mock.patch.object(infortrend_nas.LOG, 'error')
     def test_invalid_channel(self, log_error):
         self.fake_conf.set_default('infortrend_share_channels', '0, 6')
@@ -224,7 +539,315 @@ class InfortrendNASDriverTestCase(test.TestCase):
         self.assertEqual(201466179584, pool_quota)
 
     @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
-    def test_create_share_nfs(self, mock_execute):
+    def test_update_pools_stats(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_folder_status),
+            (0, self.nas_data.fake_fquota_status),
+            (0, self.nas_data.fake_get_service_status('nfs', '30.5', '10.0')),
+            (0, self.nas_data.fake_get_service_status('cifs', '20.0', '5.5')),
+        ]
+
+        pools = self._iftnas.update_pools_stats()
+
+        self.assertEqual(1, len(pools))
+        self.assertEqual('share-pool-01', pools[0]['pool_name'])
+        self.assertEqual(299.85, pools[0]['total_capacity_gb'])
+        self.assertEqual(112.22, pools[0]['free_capacity_gb'])
+        self.assertEqual(50.5, pools[0]['infortrend_cpu_rate'])
+        self.assertEqual(15.5, pools[0]['infortrend_mem_rate'])
+
+    @mock.patch.object(infortrend_nas.LOG, 'warning')
+    def test_get_controller_load_with_error(self, log_warning):
+        self._get_driver(self.fake_conf, True)
+        self._iftnas.controller_load = {
+            'A': {'cpu_rate': 50.5, 'mem_rate': 15.5}}
+        self._iftnas._execute = mock.Mock(side_effect=[
+            (0, self.nas_data.fake_get_service_status('nfs', '1.0', '1.0')),
+            exception.InfortrendNASException(err='fake error'),
+        ])
+
+        controller_load = self._iftnas._get_controller_load()
+
+        self.assertEqual({'A': {'cpu_rate': 50.5, 'mem_rate': 15.5}},
+                         controller_load)
+        self.assertEqual(1, log_warning.call_count)
+
+    def test_default_filter_and_goodness_function(self):
+        self._get_driver(self.fake_conf)
+
+        self.assertIn('capabilities.infortrend_cpu_rate',
+                      self._driver.get_filter_function())
+        self.assertIn('capabilities.infortrend_mem_rate',
+                      self._driver.get_goodness_function())
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_thin_provisioning(self, mock_execute):
+        self.fake_conf.set_default('infortrend_thin_provisioning', True)
+        self._get_driver(self.fake_conf, True)
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_folder_status),
+            (0, self.nas_data.fake_fquota_status),
+            (0, self.nas_data.fake_get_service_status('nfs', '30.5', '10.0')),
+            (0, self.nas_data.fake_get_service_status('cifs', '20.0', '5.5')),
+        ]
+
+        pools = self._iftnas.update_pools_stats()
+
+        self.assertEqual(299.85, pools[0]['total_capacity_gb'])
+        self.assertEqual(299.82, pools[0]['free_capacity_gb'])
+        self.assertEqual(187.63, pools[0]['provisioned_capacity_gb'])
+        self.assertEqual(0.03, pools[0]['allocated_capacity_gb'])
+        self.assertEqual(
+            self.fake_conf.max_over_subscription_ratio,
+            pools[0]['max_over_subscription_ratio'])
+        self.assertTrue(pools[0]['thin_provisioning'])
+        self.assertFalse(pools[0]['thick_provisioning'])
+        self.assertEqual(50.5, pools[0]['infortrend_cpu_rate'])
+        self.assertEqual(4, mock_execute.call_count)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_thin_provisioning_refresh(self,
+                                                          mock_execute):
+        self.fake_conf.set_default('infortrend_thin_provisioning', True)
+        self._get_driver(self.fake_conf, True)
+        written_folder_status = [dict(
+            self.nas_data.fake_folder_status[0],
+            free=str(321931374592 - 10 * 1024 ** 3),
+            used=str(33886208 + 10 * 1024 ** 3),
+        )] + self.nas_data.fake_folder_status[1:]
+        folder_status = iter([self.nas_data.fake_folder_status,
+                              written_folder_status])
+        mock_execute.side_effect = lambda command_line: (
+            (0, next(folder_status))
+            if command_line[0] == 'folder' else
+            (0, self.nas_data.fake_fquota_status)
+            if command_line[:2] == ['fquota', 'status'] else SUCCEED)
+
+        self._iftnas.update_pools_stats()
+        pools = self._iftnas.update_pools_stats()
+
+        self.assertEqual(289.82, pools[0]['free_capacity_gb'])
+        self.assertEqual(10.03, pools[0]['allocated_capacity_gb'])
+
+    @mock.patch.object(infortrend_nas.time, 'time')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, 'update_pools_stats')
+    def test_get_pools_stats_from_snapshot(self, mock_update_pools_stats,
+                                           mock_time):
+        self.fake_conf.set_default('infortrend_stats_refresh_interval', 60)
+        self._get_driver(self.fake_conf, True)
+        mock_update_pools_stats.side_effect = [
+            [{'pool_name': 'share-pool-01', 'free_capacity_gb': 100}],
+            [{'pool_name': 'share-pool-01', 'free_capacity_gb': 90}],
+        ]
+
+        mock_time.return_value = 1000
+        self._iftnas._refresh_pools_stats_in_background()
+        mock_time.return_value = 1030
+        pools = self._iftnas.get_pools_stats()
+
+        self.assertEqual([{'pool_name': 'share-pool-01',
+                           'free_capacity_gb': 100,
+                           'infortrend_stats_age': 30}], pools)
+        self.assertEqual(1, mock_update_pools_stats.call_count)
+
+        # Too old to be reported, refresh it at once.
+        mock_time.return_value = 1400
+        pools = self._iftnas.get_pools_stats()
+
+        self.assertEqual(90, pools[0]['free_capacity_gb'])
+        self.assertEqual(0, pools[0]['infortrend_stats_age'])
+        self.assertEqual(2, mock_update_pools_stats.call_count)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, 'update_pools_stats')
+    def test_refresh_pools_stats_in_background(self,
+                                               mock_update_pools_stats):
+        self.fake_conf.set_default('infortrend_stats_refresh_interval', 60)
+        self._get_driver(self.fake_conf, True)
+        mock_update_pools_stats.side_effect = (
+            exception.InfortrendNASException(err='fake error'))
+
+        interval = self._iftnas._refresh_pools_stats_in_background()
+
+        self.assertTrue(54 <= interval <= 66)
+        self.assertIsNone(self._iftnas.pools_stats)
+
+    @ddt.data(0, 300)
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_with_pool_cache(self, cache_ttl,
+                                                mock_execute):
+        self.fake_conf.set_default('infortrend_pool_cache_ttl', cache_ttl)
+        self._get_driver(self.fake_conf, True)
+        mock_execute.side_effect = lambda command_line: (
+            (0, self.nas_data.fake_folder_status)
+            if command_line[0] == 'folder' else
+            (0, self.nas_data.fake_fquota_status))
+
+        self._iftnas._check_pools_setup()
+        self._iftnas.update_pools_stats()
+        self._iftnas.update_pools_stats()
+
+        folder_status_calls = mock_execute.call_args_list.count(
+            mock.call(['folder', 'status']))
+        self.assertEqual(1 if cache_ttl else 3, folder_status_calls)
+        self.assertEqual(2 if cache_ttl else 0, self._iftnas.pool_cache.hits)
+
+        self._iftnas.invalidate_pool_cache()
+        self._iftnas.update_pools_stats()
+
+        self.assertEqual(
+            2 if cache_ttl else 4,
+            mock_execute.call_args_list.count(
+                mock.call(['folder', 'status'])))
+
+    @mock.patch.object(infortrend_nas.LOG, 'warning')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_with_stale_quota(self, mock_execute,
+                                                 log_warning):
+        self.fake_conf.set_default('infortrend_quota_sweep_interval', 1)
+        self._get_driver(self.fake_conf, True)
+        self._iftnas._get_controller_load = mock.Mock(return_value={})
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_folder_status),
+            exception.InfortrendNASException(err='fake error'),
+            (0, self.nas_data.fake_fquota_status),
+            exception.InfortrendNASException(err='fake error'),
+        ]
+
+        self.assertEqual([], self._iftnas.update_pools_stats())
+        fresh_pools = self._iftnas.update_pools_stats()
+        stale_pools = self._iftnas.update_pools_stats()
+
+        self.assertEqual(fresh_pools, stale_pools)
+        self.assertEqual(2, log_warning.call_count)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_with_counted_quota(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        mock_execute.side_effect = lambda command_line: (
+            (0, self.nas_data.fake_folder_status)
+            if command_line[0] == 'folder' else
+            (0, self.nas_data.fake_fquota_status)
+            if command_line[:2] == ['fquota', 'status'] else SUCCEED)
+        fquota_status = mock.call(
+            ['fquota', 'status', self.pool_id[0], 'LV-1', '-t', 'folder'])
+
+        free_capacity_gb = self._iftnas.update_pools_stats()[0][
+            'free_capacity_gb']
+        self._driver.extend_share(self.m_data.fake_share_nfs, 40)
+        pools = self._iftnas.update_pools_stats()
+
+        # The extended 10G is counted without summing the quotas again.
+        self.assertEqual(1, mock_execute.call_args_list.count(fquota_status))
+        self.assertEqual(round(free_capacity_gb - 10, 2),
+                         pools[0]['free_capacity_gb'])
+
+        self._iftnas.quota_cache.invalidate()
+        self._driver.extend_share(self.m_data.fake_share_nfs, 50)
+        self._iftnas.update_pools_stats()
+
+        self.assertEqual(2, mock_execute.call_args_list.count(fquota_status))
+        self.assertEqual(set(), self._iftnas.quota_drift)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_sweep_after_failed_create(
+            self, mock_execute, mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        fquota_errors = [None]
+
+        def _fake_execute(command_line):
+            if command_line[0] == 'folder':
+                return 0, self.nas_data.fake_folder_status
+            if command_line[:2] == ['fquota', 'status']:
+                if fquota_errors:
+                    return 0, self.nas_data.fake_fquota_status
+                raise exception.InfortrendNASException(err='timeout')
+            return SUCCEED
+
+        mock_execute.side_effect = _fake_execute
+        # The folder is created, but its quota is not.
+        mock_execute_batch.return_value = [
+            SUCCEED, (12, 'Invalid param'), SUCCEED]
+        fquota_status = mock.call(
+            ['fquota', 'status', self.pool_id[0], 'LV-1', '-t', 'folder'])
+
+        self._iftnas.update_pools_stats()
+        self.assertRaises(
+            exception.InfortrendNASException,
+            self._driver.create_share,
+            self._ctxt, self.m_data.fake_share_nfs)
+        self.assertEqual({'share-pool-01'}, self._iftnas.quota_drift)
+
+        # A failed sweep keeps the pool marked for the next cycle.
+        fquota_errors.pop()
+        self._iftnas.update_pools_stats()
+        self.assertEqual({'share-pool-01'}, self._iftnas.quota_drift)
+
+        # The sweep reads NAS again, even with the quota index cached.
+        fquota_errors.append(None)
+        self._iftnas.update_pools_stats()
+        self.assertEqual(3, mock_execute.call_args_list.count(fquota_status))
+        self.assertEqual(set(), self._iftnas.quota_drift)
+
+    @mock.patch.object(infortrend_nas.timeutils, 'utcnow')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_share_usage_size(self, mock_execute, mock_utcnow):
+        self._get_driver(self.fake_conf, True)
+        unknown_share = dict(self.m_data.fake_share_nfs,
+                             id='fake-share-id',
+                             host='fake_host@fake_backend#fake-pool')
+        shares = [self.m_data.fake_share_nfs, self.m_data.fake_share_cifs,
+                  unknown_share]
+        mock_execute.return_value = (0, self.nas_data.fake_fquota_status)
+
+        share_usages = self._driver.update_share_usage_size(
+            self._ctxt, shares)
+
+        mock_execute.assert_called_once_with(
+            ['fquota', 'status', self.pool_id[0], 'LV-1', '-t', 'folder'])
+        self.assertEqual([
+            {'id': shares[0]['id'], 'used_size': 0.0,
+             'gathered_at': mock_utcnow.return_value},
+            {'id': shares[1]['id'], 'used_size': 20.0,
+             'gathered_at': mock_utcnow.return_value},
+        ], share_usages)
+
+    @ddt.data((60, 1), (0, 2))
+    @ddt.unpack
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_share_usage_size_with_quota_cache_ttl(
+            self, quota_cache_ttl, fquota_reads, mock_execute):
+        self.fake_conf.set_default('infortrend_quota_cache_ttl',
+                                   quota_cache_ttl)
+        self._get_driver(self.fake_conf, True)
+        mock_execute.return_value = (0, self.nas_data.fake_fquota_status)
+
+        self._driver.update_share_usage_size(
+            self._ctxt, [self.m_data.fake_share_nfs])
+        share_usages = self._driver.update_share_usage_size(
+            self._ctxt, [self.m_data.fake_share_nfs])
+
+        self.assertEqual(fquota_reads, mock_execute.call_count)
+        self.assertEqual(1, len(share_usages))
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_get_pool_quota_used')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_pools_stats_with_quota_timeout(self, mock_execute,
+                                                   mock_quota_used):
+        self.fake_conf.set_default('infortrend_stats_pool_timeout', 1)
+        self._get_driver(self.fake_conf, True)
+        self._iftnas.pool_quota_used['share-pool-01'] = 201466179584
+        mock_execute.return_value = (0, self.nas_data.fake_folder_status)
+        mock_quota_used.side_effect = lambda pool_name: eventlet.sleep(5)
+
+        pools = self._iftnas.update_pools_stats()
+
+        self.assertEqual(112.22, pools[0]['free_capacity_gb'])
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_create_share_nfs(self, mock_execute, mock_execute_batch):
         self._get_driver(self.fake_conf, True)
         fake_share_id = self.m_data.fake_share_nfs['id']
         fake_share_name = fake_share_id.replace('-', '')
@@ -234,23 +857,26 @@ class InfortrendNASDriverTestCase(test.TestCase):
             self.nas_data.fake_channel_ip[1] +
             ':/share-pool-01/LV-1/' + fake_share_name,
         ]
-        mock_execute.side_effect = [
-            SUCCEED,  # create folder
-            SUCCEED,  # set size
-            (0, self.nas_data.fake_get_share_status_nfs()),  # check proto
-            SUCCEED,  # enable proto
-            (0, self.nas_data.fake_get_channel_status())  # update channel
-        ]
+        mock_execute_batch.return_value = [SUCCEED] * 3
+        mock_execute.return_value = (
+            0, self.nas_data.fake_get_channel_status())  # update channel
 
         locations = self._driver.create_share(
             self._ctxt, self.m_data.fake_share_nfs)
 
         self.assertEqual(expect_locations, locations)
-        mock_execute.assert_any_call(
-            ['share', self.pool_path[0] + fake_share_name, 'nfs', 'on'])
+        mock_execute_batch.assert_called_once_with([
+            ['folder', 'options', self.pool_id[0], 'LV-1',
+             '-c', fake_share_name],
+            ['fquota', 'create', self.pool_id[0], 'LV-1',
+             fake_share_name, '30G', '-t', 'folder'],
+            ['share', self.pool_path[0] + fake_share_name, 'nfs', 'on'],
+        ], raise_error=False)
+        mock_execute.assert_called_once_with(['ifconfig', 'inet', 'show'])
 
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
     @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
-    def test_create_share_cifs(self, mock_execute):
+    def test_create_share_cifs(self, mock_execute, mock_execute_batch):
         self._get_driver(self.fake_conf, True)
         fake_share_id = self.m_data.fake_share_cifs['id']
         fake_share_name = fake_share_id.replace('-', '')
@@ -260,21 +886,255 @@ class InfortrendNASDriverTestCase(test.TestCase):
             '\\\\' + self.nas_data.fake_channel_ip[1] +
             '\\' + fake_share_name,
         ]
-        mock_execute.side_effect = [
-            SUCCEED,  # create folder
-            SUCCEED,  # set size
-            (0, self.nas_data.fake_get_share_status_cifs()),  # check proto
-            SUCCEED,  # enable proto
-            (0, self.nas_data.fake_get_channel_status())  # update channel
-        ]
+        mock_execute_batch.return_value = [SUCCEED] * 3
+        mock_execute.return_value = (
+            0, self.nas_data.fake_get_channel_status())  # update channel
 
         locations = self._driver.create_share(
             self._ctxt, self.m_data.fake_share_cifs)
 
         self.assertEqual(expect_locations, locations)
-        mock_execute.assert_any_call(
+        mock_execute_batch.assert_called_once_with([
+            ['folder', 'options', self.pool_id[0], 'LV-1',
+             '-c', fake_share_name],
+            ['fquota', 'create', self.pool_id[0], 'LV-1',
+             fake_share_name, '50G', '-t', 'folder'],
             ['share', self.pool_path[0] + fake_share_name,
-             'cifs', 'on', '-n', fake_share_name])
+             'cifs', 'on', '-n', fake_share_name],
+        ], raise_error=False)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    def test_create_share_with_error(self, mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        mock_execute_batch.side_effect = exception.InfortrendNASException(
+            err='Batch command failed')
+        self._iftnas.share_cache.set('share-pool-01', set())
+
+        self.assertRaises(
+            exception.InfortrendNASException,
+            self._driver.create_share,
+            self._ctxt, self.m_data.fake_share_nfs)
+        self.assertEqual(set(),
+                         self._iftnas.share_cache.peek('share-pool-01'))
+
+    @mock.patch.object(infortrend_nas.greenthread, 'spawn_n')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_create_share_from_warm_pool(self, mock_execute,
+                                         mock_execute_batch, mock_spawn_n):
+        self._get_driver(self.fake_conf, True)
+        fake_share_name = self.m_data.fake_share_nfs['id'].replace('-', '')
+        self._iftnas.warm_pool_size = 2
+        self._iftnas.warm_folders = {
+            'share-pool-01': ['manilawarm01', 'manilawarm02']}
+        self._iftnas.share_cache.set(
+            'share-pool-01', {'manilawarm01', 'manilawarm02'})
+        mock_execute_batch.return_value = [SUCCEED] * 3
+        mock_execute.return_value = (
+            0, self.nas_data.fake_get_channel_status())
+
+        self._driver.create_share(self._ctxt, self.m_data.fake_share_nfs)
+
+        self.assertEqual(
+            ['folder', 'options', self.pool_id[0], 'LV-1',
+             '-k', 'manilawarm01', fake_share_name],
+            mock_execute_batch.call_args[0][0][0])
+        self.assertEqual(['manilawarm02'],
+                         self._iftnas.warm_folders['share-pool-01'])
+        self.assertEqual({'manilawarm02', fake_share_name},
+                         self._iftnas.share_cache.peek('share-pool-01'))
+        mock_spawn_n.assert_called_once_with(
+            self._iftnas._refill_warm_pools)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_create_share_with_warm_folder_gone(self, mock_execute,
+                                                mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        fake_share_name = self.m_data.fake_share_nfs['id'].replace('-', '')
+        self._iftnas.warm_folders = {'share-pool-01': ['manilawarm01']}
+        mock_execute_batch.side_effect = [
+            [(12, 'Invalid param')] * 3,  # rename the removed placeholder
+            [SUCCEED] * 3,
+        ]
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_subfolder_data),  # check placeholder
+            (0, self.nas_data.fake_get_channel_status()),
+        ]
+
+        self._driver.create_share(self._ctxt, self.m_data.fake_share_nfs)
+
+        self.assertEqual(
+            ['folder', 'options', self.pool_id[0], 'LV-1',
+             '-c', fake_share_name],
+            mock_execute_batch.call_args[0][0][0])
+        self.assertEqual([], self._iftnas.warm_folders['share-pool-01'])
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_create_share_release_warm_folder(self, mock_execute,
+                                              mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        subfolders = self.nas_data.fake_subfolder_data + [
+            dict(self.nas_data.fake_subfolder_data[0], name='manilawarm01')]
+        self._iftnas.warm_folders = {'share-pool-01': ['manilawarm01']}
+        mock_execute_batch.side_effect = [
+            [(12, 'Invalid param'), (12, 'Invalid param'), SUCCEED],
+            [SUCCEED, (12, 'Invalid param'), SUCCEED],
+        ]
+        mock_execute.return_value = (0, subfolders)
+
+        self.assertRaisesRegex(
+            exception.InfortrendNASException,
+            'fquota create',
+            self._driver.create_share,
+            self._ctxt, self.m_data.fake_share_nfs)
+        self.assertEqual(['manilawarm01'],
+                         self._iftnas.warm_folders['share-pool-01'])
+        self.assertIn('share-pool-01', self._iftnas.quota_drift)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    def test_refill_warm_pools(self, mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        self._iftnas.warm_pool_size = 3
+        self._iftnas.warm_folders = {'share-pool-01': ['manilawarm01']}
+        mock_execute_batch.return_value = [SUCCEED, (12, 'Invalid param')]
+
+        self._iftnas._refill_warm_pools()
+
+        command_lines = mock_execute_batch.call_args[0][0]
+        self.assertEqual(2, len(command_lines))
+        self.assertEqual(['folder', 'options', self.pool_id[0], 'LV-1', '-c'],
+                         command_lines[0][:5])
+        self.assertTrue(command_lines[0][5].startswith('manilawarm'))
+        self.assertEqual(['manilawarm01', command_lines[0][5]],
+                         self._iftnas.warm_folders['share-pool-01'])
+        self.assertFalse(self._iftnas.warm_refilling)
+
+    def test_load_warm_folders(self):
+        self._get_driver(self.fake_conf, True)
+        subfolders = self.nas_data.fake_subfolder_data + [
+            dict(self.nas_data.fake_subfolder_data[0], name='manilawarm01')]
+        self._iftnas._execute = mock.Mock(return_value=(0, subfolders))
+
+        self._iftnas._load_warm_folders()
+
+        self.assertEqual({'share-pool-01': ['manilawarm01']},
+                         self._iftnas.warm_folders)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_delete_share_async(self, mock_execute, mock_execute_batch):
+        queue_dir = self.useFixture(fixtures.TempDir()).path
+        self.fake_conf.set_default('infortrend_async_delete', True)
+        self.fake_conf.set_default('infortrend_delete_queue_dir', queue_dir)
+        self._get_driver(self.fake_conf, True)
+        share_name = self.nas_data.fake_share_name[0]
+        share_path = self.pool_path[0] + share_name
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_subfolder_data),  # pagelist folder
+            SUCCEED,  # nfs off
+        ]
+
+        self._driver.delete_share(self._ctxt, self.m_data.fake_share_nfs)
+
+        mock_execute.assert_has_calls([
+            mock.call(['pagelist', 'folder', self.pool_path[0]]),
+            mock.call(['share', share_path, 'nfs', 'off'])])
+        mock_execute_batch.assert_not_called()
+        with open(os.path.join(
+                queue_dir, 'infortrend_delete_queue_default.json')) as f:
+            self.assertEqual([{'pool': 'share-pool-01',
+                               'share': share_name}], json.load(f))
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_delete_share_async_already_queued(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_name = self.nas_data.fake_share_name[0]
+        self._iftnas.delete_queue_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'queue.json')
+        self._iftnas.delete_queue = [
+            {'pool': 'share-pool-01', 'share': share_name}]
+        self._iftnas.share_cache.set(
+            'share-pool-01', set(self.nas_data.fake_share_name))
+
+        self._driver.delete_share(self._ctxt, self.m_data.fake_share_nfs)
+
+        mock_execute.assert_not_called()
+        self.assertEqual([{'pool': 'share-pool-01', 'share': share_name}],
+                         self._iftnas.delete_queue)
+
+    def test_process_delete_queue(self):
+        self._get_driver(self.fake_conf, True)
+        self._iftnas.delete_queue_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'queue.json')
+        share_names = self.nas_data.fake_share_name
+        self._iftnas.share_cache.set('share-pool-01', set(share_names))
+        self._iftnas.delete_queue = [
+            {'pool': 'share-pool-01', 'share': share_names[0]},
+            {'pool': 'share-pool-01', 'share': share_names[1]},
+        ]
+        subfolders = [subfolder
+                      for subfolder in self.nas_data.fake_subfolder_data
+                      if subfolder['name'] != share_names[0]]
+
+        def _fake_execute(command_line):
+            if command_line[0] == 'pagelist':
+                return 0, subfolders
+            if command_line[-1] == share_names[1]:
+                raise exception.InfortrendNASException(err='busy')
+            return SUCCEED
+
+        self._iftnas._execute = mock.Mock(side_effect=_fake_execute)
+
+        self._iftnas._process_delete_queue()
+
+        self._iftnas._execute.assert_any_call(
+            ['folder', 'options', self.pool_id[0], 'LV-1',
+             '-d', share_names[0]])
+        self.assertEqual([{'pool': 'share-pool-01', 'share': share_names[1]}],
+                         self._iftnas._load_delete_queue())
+        share_index = self._iftnas.share_cache.peek('share-pool-01')
+        self.assertIn(share_names[1], share_index)
+        self.assertNotIn(share_names[0], share_index)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_delete_share_removed_outside(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_names = self.nas_data.fake_share_name
+        self._iftnas.share_cache.set('share-pool-01', set(share_names))
+        mock_execute.side_effect = [
+            exception.InfortrendNASException(err='No such folder'),
+            (0, [subfolder  # pagelist folder
+                 for subfolder in self.nas_data.fake_subfolder_data
+                 if subfolder['name'] != share_names[0]]),
+        ]
+
+        self._driver.delete_share(self._ctxt, self.m_data.fake_share_nfs)
+
+        mock_execute.assert_has_calls([
+            mock.call(['folder', 'options', self.pool_id[0],
+                       'LV-1', '-d', share_names[0]]),
+            mock.call(['pagelist', 'folder', self.pool_path[0]])])
+        self.assertNotIn(share_names[0],
+                         self._iftnas.share_cache.peek('share-pool-01'))
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_delete_share_with_error(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        self._iftnas.share_cache.set(
+            'share-pool-01', set(self.nas_data.fake_share_name))
+        mock_execute.side_effect = [
+            exception.InfortrendNASException(err='Folder is busy'),
+            (0, self.nas_data.fake_subfolder_data),  # pagelist folder
+        ]
+
+        self.assertRaisesRegex(
+            exception.InfortrendNASException,
+            'Folder is busy',
+            self._driver.delete_share,
+            self._ctxt, self.m_data.fake_share_nfs)
+        self.assertIn('share-pool-01', self._iftnas.quota_drift)
 
     @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
     def test_delete_share_nfs(self, mock_execute):
@@ -323,6 +1183,254 @@ class InfortrendNASDriverTestCase(test.TestCase):
 
         self.assertEqual(1, log_warning.call_count)
 
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_nfs(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_id = self.m_data.fake_share_nfs['id']
+        share_path = self.pool_path[0] + share_id.replace('-', '')
+        access_rules = [
+            dict(self.m_data.fake_rule_ip_1[0], access_level='ro'),
+            dict(self.m_data.fake_rule_ip_2[0], access_to='172.27.1.3'),
+        ]
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_share_status_nfs_with_rules),
+            SUCCEED,  # evict 172.27.1.2
+            SUCCEED,  # change 172.27.1.1 to ro
+            SUCCEED,  # allow 172.27.1.3
+        ]
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_nfs, access_rules, [], [])
+
+        self.assertEqual({}, access_dict)
+        mock_execute.assert_has_calls([
+            mock.call(['share', 'status', '-f', share_path]),
+            mock.call(['share', 'options', share_path,
+                       'nfs', '-c', '172.27.1.2']),
+            mock.call(['share', 'options', share_path,
+                       'nfs', '-h', '172.27.1.1', '-p', 'ro']),
+            mock.call(['share', 'options', share_path,
+                       'nfs', '-h', '172.27.1.3', '-p', 'rw'])])
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_nfs_already_in_sync(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        mock_execute.return_value = (
+            0, self.nas_data.fake_share_status_nfs_with_rules)
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_nfs,
+            self.m_data.fake_access_rules_nfs, [], [])
+
+        self.assertEqual({}, access_dict)
+        self.assertEqual(1, mock_execute.call_count)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_cifs_with_error(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_id = self.m_data.fake_share_cifs['id']
+        share_path = self.pool_path[0] + share_id.replace('-', '')
+        access_rules = [
+            self.m_data.fake_access_rules_cifs[0],
+            dict(self.m_data.fake_access_rules_cifs[1], access_level='ro'),
+            self.m_data.fake_rule_user03[0],
+        ]
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_share_status_cifs_with_rules),
+            SUCCEED,  # evict users
+            (0, self.nas_data.fake_cifs_user_list),  # check user01
+            (0, self.nas_data.fake_cifs_user_list),  # check user03
+            SUCCEED,  # change user01 to ro
+        ]
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_cifs, access_rules, [], [])
+
+        self.assertEqual({access_rules[2]['id']: 'error'}, access_dict)
+        mock_execute.assert_has_calls([
+            mock.call(['acl', 'get', share_path]),
+            mock.call(['acl', 'delete', share_path, '-u', 'users']),
+            mock.call(['useradmin', 'user', 'list']),
+            mock.call(['useradmin', 'user', 'list']),
+            mock.call(['acl', 'set', share_path,
+                       '-u', 'user01', '-a', 'r'])])
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_nfs_with_changes(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_id = self.m_data.fake_share_nfs['id']
+        share_path = self.pool_path[0] + share_id.replace('-', '')
+        mock_execute.return_value = SUCCEED
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_nfs,
+            self.m_data.fake_rule_ip_1, self.m_data.fake_rule_ip_1,
+            self.m_data.fake_rule_ip_2)
+
+        self.assertEqual({}, access_dict)
+        self.assertEqual(2, mock_execute.call_count)
+        mock_execute.assert_has_calls([
+            mock.call(['share', 'options', share_path,
+                       'nfs', '-c', '172.27.1.2']),
+            mock.call(['share', 'options', share_path,
+                       'nfs', '-h', '172.27.1.1', '-p', 'rw'])])
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_nfs_bulk(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_id = self.m_data.fake_share_nfs['id']
+        share_path = self.pool_path[0] + share_id.replace('-', '')
+        add_rules = self.m_data.fake_rule_ip_1 + self.m_data.fake_rule_ip_2
+        mock_execute.return_value = SUCCEED
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_nfs,
+            add_rules, add_rules, [])
+
+        self.assertEqual({}, access_dict)
+        mock_execute.assert_called_once_with(
+            ['share', 'options', share_path, 'nfs',
+             '-h', '172.27.1.1,172.27.1.2', '-p', 'rw'])
+
+    @ddt.data(exception.InfortrendCLIException(
+                  err='Invalid param', rc=12, out='Invalid param'),
+              exception.InfortrendNASException(err='Invalid param'))
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_nfs_bulk_rejected(self, error, mock_execute,
+                                             mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        share_id = self.m_data.fake_share_nfs['id']
+        share_path = self.pool_path[0] + share_id.replace('-', '')
+        add_rules = self.m_data.fake_rule_ip_1 + self.m_data.fake_rule_ip_2
+        mock_execute.side_effect = error
+        mock_execute_batch.return_value = [SUCCEED, (12, 'Invalid param')]
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_nfs,
+            add_rules, add_rules, [])
+
+        self.assertEqual({add_rules[1]['id']: 'error'}, access_dict)
+        mock_execute_batch.assert_called_once_with([
+            ['share', 'options', share_path, 'nfs',
+             '-h', '172.27.1.1', '-p', 'rw'],
+            ['share', 'options', share_path, 'nfs',
+             '-h', '172.27.1.2', '-p', 'rw'],
+        ], raise_error=False)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute_batch')
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_nfs_bulk_with_nas_unreachable(
+            self, mock_execute, mock_execute_batch):
+        self._get_driver(self.fake_conf, True)
+        add_rules = self.m_data.fake_rule_ip_1 + self.m_data.fake_rule_ip_2
+        mock_execute.side_effect = infortrend_nas.NASUnreachableException(
+            err='timeout')
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_nfs,
+            add_rules, add_rules, [])
+
+        self.assertEqual({add_rules[0]['id']: 'error',
+                          add_rules[1]['id']: 'error'}, access_dict)
+        mock_execute_batch.assert_not_called()
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_cifs_with_deleted_rule(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_id = self.m_data.fake_share_cifs['id']
+        share_path = self.pool_path[0] + share_id.replace('-', '')
+        mock_execute.return_value = SUCCEED
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_cifs,
+            self.m_data.fake_rule_user01, [], self.m_data.fake_rule_user02)
+
+        self.assertEqual({}, access_dict)
+        mock_execute.assert_called_once_with(
+            ['acl', 'delete', share_path, '-u', 'user02'])
+
+    @ddt.data(exception.InfortrendCLIException(
+                  err='Invalid param', rc=12, out='Invalid param'),
+              exception.InfortrendNASException(err='Invalid param'))
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_cifs_with_rejected_deny(self, error,
+                                                   mock_execute):
+        self._get_driver(self.fake_conf, True)
+        mock_execute.side_effect = error
+
+        access_dict = self._driver.update_access(
+            self._ctxt, self.m_data.fake_share_cifs,
+            self.m_data.fake_rule_user01, [], self.m_data.fake_rule_user02)
+
+        self.assertEqual({}, access_dict)
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_update_access_deny_with_nas_unreachable(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        mock_execute.side_effect = infortrend_nas.NASUnreachableException(
+            err='timeout')
+
+        self.assertRaises(
+            infortrend_nas.NASUnreachableException,
+            self._driver.update_access,
+            self._ctxt, self.m_data.fake_share_cifs,
+            self.m_data.fake_rule_user01, [], self.m_data.fake_rule_user02)
+
+    def test_check_user_exist_with_user_cache(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas._execute = mock.Mock(
+            return_value=(0, self.nas_data.fake_cifs_user_list))
+
+        self.assertTrue(self._iftnas._check_user_exist('user01'))
+        self.assertTrue(self._iftnas._check_user_exist('user02'))
+        self.assertEqual(1, self._iftnas._execute.call_count)
+
+        self.assertFalse(self._iftnas._check_user_exist('user03'))
+        self.assertEqual(2, self._iftnas._execute.call_count)
+
+    def test_check_user_exist_not_reload_new_list(self):
+        self._get_driver(self.fake_conf)
+        self._iftnas._execute = mock.Mock(
+            return_value=(0, self.nas_data.fake_cifs_user_list))
+
+        self.assertFalse(self._iftnas._check_user_exist('user03'))
+        self._iftnas._execute.assert_called_once_with(
+            ['useradmin', 'user', 'list'])
+
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_share_index_updated_by_create_and_delete(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_name = self.m_data.fake_share_nfs['id'].replace('-', '')
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_subfolder_data),  # build index
+            SUCCEED,  # delete folder
+        ]
+
+        self.assertTrue(
+            self._iftnas._check_share_exist('share-pool-01', 'test-folder'))
+        self._driver.delete_share(self._ctxt, self.m_data.fake_share_nfs)
+
+        self.assertNotIn(
+            share_name, self._iftnas.share_cache.peek('share-pool-01'))
+        self.assertTrue(
+            self._iftnas._check_share_exist('share-pool-01', 'test-folder'))
+        self.assertEqual(2, mock_execute.call_count)
+
+    def test_share_index_rebuild_on_miss(self):
+        self._get_driver(self.fake_conf, True)
+        self._iftnas._execute = mock.Mock(side_effect=[
+            (0, self.nas_data.fake_subfolder_data[:1]),
+            (0, self.nas_data.fake_subfolder_data),
+        ])
+
+        self._iftnas._check_share_exist('share-pool-01', 'UserHome')
+        exist = self._iftnas._check_share_exist(
+            'share-pool-01', 'test-folder')
+
+        self.assertTrue(exist)
+        self.assertEqual(2, self._iftnas._execute.call_count)
+
     def test_get_pool(self):
         self._get_driver(self.fake_conf, True)
         pool = self._driver.get_pool(self.m_data.fake_share_nfs)
@@ -373,6 +1481,66 @@ class InfortrendNASDriverTestCase(test.TestCase):
 
         self.assertEqual(expect_locations, locations)
 
+    def test_get_backend_info(self):
+        self._get_driver(self.fake_conf, True)
+
+        backend_info = self._driver.get_backend_info(self._ctxt)
+
+        self.assertEqual({
+            'version': self._driver.VERSION,
+            'nas_ip': self.fake_conf.infortrend_nas_ip,
+            'pools': 'share-pool-01:%s:%s' % (self.pool_id[0],
+                                              self.pool_path[0]),
+            'channels': '0:%s,1:%s' % (self.nas_data.fake_channel_ip[0],
+                                       self.nas_data.fake_channel_ip[1]),
+        }, backend_info)
+
+        self._iftnas.channel_dict['1'] = ''
+        self.assertNotEqual(backend_info,
+                            self._driver.get_backend_info(self._ctxt))
+
+    def test_ensure_shares(self):
+        self._get_driver(self.fake_conf, True)
+        shares = [self.m_data.fake_share_nfs, self.m_data.fake_share_cifs]
+        nfs_path = (self.pool_path[0] +
+                    self.m_data.fake_share_nfs['id'].replace('-', ''))
+        self._iftnas._execute = mock.Mock(
+            return_value=(0, self.nas_data.fake_get_channel_status()))
+
+        updates = self._driver.ensure_shares(self._ctxt, shares)
+
+        self._iftnas._execute.assert_called_once_with(
+            ['ifconfig', 'inet', 'show'])
+        self.assertEqual({
+            'export_locations': [
+                self.nas_data.fake_channel_ip[0] + ':' + nfs_path,
+                self.nas_data.fake_channel_ip[1] + ':' + nfs_path,
+            ],
+            'status': 'available',
+            'reapply_access_rules': False,
+        }, updates[shares[0]['id']])
+        self.assertEqual('available', updates[shares[1]['id']]['status'])
+        self.assertEqual(2, len(updates[shares[1]['id']]['export_locations']))
+
+    def test_ensure_shares_check_exist(self):
+        self.fake_conf.set_default('infortrend_ensure_shares_check_exist',
+                                   True)
+        self._get_driver(self.fake_conf, True)
+        shares = [self.m_data.fake_share_nfs, self.m_data.fake_share_cifs]
+        self._iftnas._execute = mock.Mock(side_effect=[
+            (0, self.nas_data.fake_get_channel_status()),
+            (0, self.nas_data.fake_subfolder_data[:3]),
+        ])
+
+        updates = self._driver.ensure_shares(self._ctxt, shares)
+
+        self._iftnas._execute.assert_called_with(
+            ['pagelist', 'folder', self.pool_path[0]])
+        self.assertEqual(2, self._iftnas._execute.call_count)
+        self.assertEqual('available', updates[shares[0]['id']]['status'])
+        self.assertEqual({'status': 'error', 'reapply_access_rules': False},
+                         updates[shares[1]['id']])
+
     def test_extend_share(self):
         self._get_driver(self.fake_conf, True)
         share_id = self.m_data.fake_share_nfs['id']
@@ -403,6 +1571,27 @@ class InfortrendNASDriverTestCase(test.TestCase):
             mock.call(['fquota', 'create', self.pool_id[0],
                        'LV-1', share_name, '10G', '-t', 'folder'])])
 
+    @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
+    def test_quota_index_shared_by_stats_and_resize(self, mock_execute):
+        self._get_driver(self.fake_conf, True)
+        share_name = self.m_data.fake_share_nfs['id'].replace('-', '')
+        mock_execute.side_effect = [
+            (0, self.nas_data.fake_fquota_status),  # build index
+            SUCCEED,  # extend share
+        ]
+
+        self._iftnas.pool_quota_used['share-pool-01'] = (
+            self._iftnas._get_pool_quota_used('share-pool-01'))
+        self._driver.extend_share(self.m_data.fake_share_nfs, 100)
+        pool_quota_used = self._iftnas._get_pool_quota_used(
+            'share-pool-01', sweep=False)
+        share_quota = self._iftnas.quota_cache.peek('share-pool-01')[
+            share_name]
+
+        self.assertEqual(2, mock_execute.call_count)
+        self.assertEqual(100 * 1024 ** 3, share_quota['quota'])
+        self.assertEqual(201466179584 + 70 * 1024 ** 3, pool_quota_used)
+
     @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
     def test_shrink_share_smaller_than_used_size(self, mock_execute):
         self._get_driver(self.fake_conf, True)
@@ -421,9 +1610,25 @@ class InfortrendNASDriverTestCase(test.TestCase):
         self._iftnas._execute = mock.Mock(
             return_value=(0, self.nas_data.fake_fquota_status))
 
-        size = self._iftnas._get_share_size('', '', 'test-folder-02')
+        size = self._iftnas._get_share_size(
+            self.pool_id[0], 'share-pool-01', 'test-folder-02')
 
         self.assertEqual(87.63, size)
+        self._iftnas._execute.assert_called_once_with(
+            ['fquota', 'status', self.pool_id[0], 'LV-1', '-t', 'folder'])
+
+    def test_get_share_size_not_in_quota_index(self):
+        self._get_driver(self.fake_conf, True)
+        self._iftnas.quota_cache.set('share-pool-01', {})
+        self._iftnas._execute = mock.Mock(
+            return_value=(0, self.nas_data.fake_fquota_status))
+
+        size = self._iftnas._get_share_size(
+            self.pool_id[0], 'share-pool-01', 'test-folder-02')
+
+        self.assertEqual(87.63, size)
+        self.assertIn('test-folder-02',
+                      self._iftnas.quota_cache.peek('share-pool-01'))
 
     @mock.patch.object(infortrend_nas.InfortrendNAS, '_execute')
     def test_manage_existing_nfs(self, mock_execute):
@@ -459,7 +1664,7 @@ class InfortrendNASDriverTestCase(test.TestCase):
             mock.call(['share', 'status', '-f', origin_share_path]),
             mock.call(['share', origin_share_path, 'nfs', 'on']),
             mock.call(['fquota', 'status', self.pool_id[0],
-                       origin_share_path.split('/')[3], '-t', 'folder']),
+                       'LV-1', '-t', 'folder']),
             mock.call(['folder', 'options', self.pool_id[0],
                        'LV-1', '-k', 'test-folder', share_name]),
             mock.call(['ifconfig', 'inet', 'show']),
@@ -499,7 +1704,7 @@ class InfortrendNASDriverTestCase(test.TestCase):
             mock.call(['share', origin_share_path, 'cifs', 'on',
                        '-n', share_name]),
             mock.call(['fquota', 'status', self.pool_id[0],
-                       origin_share_path.split('/')[3], '-t', 'folder']),
+                       'LV-1', '-t', 'folder']),
             mock.call(['folder', 'options', self.pool_id[0],
                        'LV-1', '-k', 'test-folder-02', share_name]),
             mock.call(['ifconfig', 'inet', 'show']),
@@ -520,7 +1725,10 @@ class InfortrendNASDriverTestCase(test.TestCase):
         self._get_driver(self.fake_conf, True)
         fake_share = self.m_data._get_fake_share_for_manage(fake_share_path)
         self._iftnas._execute = mock.Mock(
-            return_value=(0, self.nas_data.fake_subfolder_data))
+            side_effect=lambda command_line: (
+                (0, self.nas_data.fake_get_channel_status())
+                if command_line[0] == 'ifconfig' else
+                (0, self.nas_data.fake_subfolder_data)))
 
         self.assertRaises(
             exception.InfortrendNASException,